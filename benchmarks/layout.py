@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""Measure layout throughput on synthetic corpora, without a display.
+
+Fonts are stood in for by `FakeFont`, whose widths come from a fixed
+table, so every run lays out exactly the same lines.  Each corpus is
+built from the "Steam" essay in ``examples/steam`` and can be scaled
+up: ``steam`` repeats the whole essay, ``long`` makes each section of
+the essay a single paragraph repeated over and over, and ``narrow``
+sets the repeated essay in a narrow column.
+
+For each corpus and scale, the document is composed from scratch to
+measure paragraphs and pages per second, then composed again under
+`tracemalloc` for its peak memory.  Its paragraphs are then taken
+through the stages of `knuth_paragraph()` one at a time -- tokenize,
+hyphenate, measure into boxes, and break -- and finally composed once
+more with every paragraph already broken, which leaves only the work of
+placing the lines.  Since the copies of a repeated essay are the same
+paragraphs, most of them come from `paragraph_cache` unless the cache
+is turned off with ``--no-paragraph-cache``.  With ``--draft``, the
+documents are composed as drafts, breaking lines first-fit.  The
+results can be saved as JSON, and compared with an earlier run::
+
+    benchmarks/layout.py --scale 1 4 --json new.json --compare old.json
+
+"""
+import argparse
+import contextlib
+import datetime
+import gc
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from typesetting.composing import (
+    avoid_widows_and_orphans, centered_paragraph, compose, section_break,
+    vskip,
+)
+from typesetting.knuth import (
+    _build_object_list, _text_findall, _tolerances, knuth_paragraph,
+    paragraph_cache,
+)
+from typesetting.skeleton import Font, single_column_layout, unroll
+from typesetting.vendored.hyphenate import hyphenate_word, hyphenator
+from typesetting.vendored.texlib_wrap import BreakStats
+
+INCH = 72
+INDENT = INCH / 4
+STEAM_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '..', 'examples', 'steam', 'steam.txt')
+
+# Character widths, in ems, loosely like those of a book face.
+_widths = {}
+_widths.update(dict.fromkeys('fijlrt.,;:\'’!|()- ', 0.3))
+_widths.update(dict.fromkeys('mwMW—', 0.85))
+_widths.update(dict.fromkeys('ABCDEFGHKNOPQRUVXYZ', 0.7))
+
+class FakeFont(Font):
+    """A font whose widths come from a table instead of a font file."""
+
+    def width_of(self, text):
+        get = _widths.get
+        return sum(get(c, 0.5) for c in text) * self.height
+
+FONTS = {
+    'roman': FakeFont(9, 3, 12, 2),
+    'title': FakeFont(22, 8, 30, 4),
+}
+
+def steam_actions(essay, copies):
+    """Return the actions for `copies` of the essay, one after another."""
+    my_break = section_break, 'roman', ('texts', [(0, 'roman', '* * *')])
+    actions = [
+        (centered_paragraph, [('roman', ' ')]),
+        (vskip, INCH * 3/4),
+        (centered_paragraph, [('title', 'Steam')]),
+        my_break,
+        (centered_paragraph, [('roman', 'J. Elmer Rhodes, Jr.')]),
+        (vskip, INCH * 3/4),
+    ]
+    sections = essay.strip().split('\n\n\n')
+    for copy in range(copies):
+        for i, section in enumerate(sections):
+            if copy or i:
+                actions.append(my_break)
+            paragraphs = section.strip().split('\n\n')
+            for j, paragraph in enumerate(paragraphs):
+                indent = INDENT if j else 0
+                actions.append((avoid_widows_and_orphans,))
+                actions.append((knuth_paragraph, 0, indent,
+                                [('roman', paragraph.strip())]))
+    return actions
+
+def long_actions(essay, copies):
+    """Return one paragraph per section of the essay, repeated `copies`
+    times over."""
+    actions = []
+    for section in essay.strip().split('\n\n\n'):
+        text = ' '.join(section.split())
+        actions.append((knuth_paragraph, 0, INDENT,
+                        [('roman', ' '.join([text] * copies))]))
+    return actions
+
+# Each corpus: its actions, and the page layout to set them in.
+CORPORA = {
+    'steam': (steam_actions, (5 * INCH, 8 * INCH, INCH, INCH,
+                              0.8 * INCH, 0.8 * INCH)),
+    'long': (long_actions, (5 * INCH, 8 * INCH, INCH, INCH,
+                            0.8 * INCH, 0.8 * INCH)),
+    'narrow': (steam_actions, (3 * INCH, 8 * INCH, INCH, INCH,
+                               0.8 * INCH, 0.8 * INCH)),
+}
+
+def clear_caches():
+    paragraph_cache.clear()
+    hyphenator.memo.clear()
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+def peak_memory(function):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+def paragraph_inputs(actions, width):
+    """Return ``(fonts_and_texts, first_indent, line_lengths)`` for each
+    `knuth_paragraph()` among `actions`, as `break_paragraph()` sees it."""
+    inputs = []
+    for action in actions:
+        if action[0] is knuth_paragraph:
+            indent, first_indent, fonts_and_texts = action[1:4]
+            inputs.append((fonts_and_texts, first_indent, [width - indent]))
+    return inputs
+
+def space_glue_of(font):
+    space_width = font.width_of('m m') - font.width_of('mm')
+    return space_width, space_width * .5, space_width * .3333
+
+def stage_times(actions, fonts, next_line, width, draft=False):
+    """Time each stage of breaking the paragraphs, and of placing them."""
+    inputs = paragraph_inputs(actions, width)
+    stages = {}
+    clear_caches()
+
+    def tokenize():
+        return [[token for font_name, text in fonts_and_texts
+                 for token in _text_findall(text)]
+                for fonts_and_texts, first_indent, lengths in inputs]
+    tokens, stages['tokenize'] = timed(tokenize)
+
+    def hyphenate():
+        for paragraph_tokens in tokens:
+            for control_code, word, punctuation, space in paragraph_tokens:
+                if word:
+                    hyphenate_word(word)
+    _, stages['hyphenate'] = timed(hyphenate)
+
+    def measure():
+        olists = []
+        for fonts_and_texts, first_indent, lengths in inputs:
+            font = fonts[fonts_and_texts[0][0]]
+            olists.append(_build_object_list(
+                fonts, fonts_and_texts, first_indent, space_glue_of(font),
+                hyphenate_word))
+        return olists
+    olists, stages['measure'] = timed(measure)
+
+    stats = BreakStats()
+
+    def break_lines():
+        for olist, (fonts_and_texts, first_indent, lengths) in zip(olists,
+                                                                   inputs):
+            if draft:
+                olist.compute_breakpoints_first_fit(lengths)
+                continue
+            try:
+                olist.compute_breakpoints_escalating(
+                    lengths, tolerances=_tolerances, stats=stats)
+            except RuntimeError:
+                stats.failed += 1
+    _, stages['break'] = timed(break_lines)
+
+    # With every paragraph in the cache, composing only places lines.
+    compose_quietly(actions, fonts, next_line, draft)
+    _, stages['place'] = timed(
+        lambda: compose_quietly(actions, fonts, next_line, draft))
+    return stages, stats
+
+def compose_quietly(actions, fonts, next_line, draft=False):
+    """Compose, keeping the FAIL of each unbreakable paragraph quiet."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return compose(actions, fonts, None, next_line, draft=draft)
+
+def run(corpus, scale, essay, use_paragraph_cache=True, draft=False):
+    make_actions, layout = CORPORA[corpus]
+    actions = make_actions(essay, scale)
+    next_line = single_column_layout(*layout)
+    width = next_line(None, 0, 0).column.width
+    paragraphs = sum(1 for action in actions if action[0] is knuth_paragraph)
+
+    old_maxsize = paragraph_cache.maxsize
+    try:
+        if not use_paragraph_cache:
+            paragraph_cache.maxsize = 0
+        clear_caches()
+        end_line, seconds = timed(
+            lambda: compose_quietly(actions, FONTS, next_line, draft))
+        lines = unroll(None, end_line)[1:]
+        pages = len({id(line.column.page) for line in lines})
+
+        clear_caches()
+        peak = peak_memory(
+            lambda: compose_quietly(actions, FONTS, next_line, draft))
+
+        paragraph_cache.maxsize = len(actions)
+        stages, stats = stage_times(actions, FONTS, next_line, width, draft)
+    finally:
+        paragraph_cache.maxsize = old_maxsize
+        clear_caches()
+
+    return {
+        'corpus': corpus,
+        'scale': scale,
+        'paragraph_cache': use_paragraph_cache,
+        'draft': draft,
+        'paragraphs': paragraphs,
+        'lines': len(lines),
+        'pages': pages,
+        'seconds': seconds,
+        'paragraphs_per_second': paragraphs / seconds,
+        'pages_per_second': pages / seconds,
+        'peak_memory_mb': peak / 1e6,
+        'compute_breakpoints_seconds': stages['break'],
+        'stages': stages,
+        'breaking': stats.as_dict(),
+    }
+
+def run_key(r):
+    """Return what a run must share with another to be compared with it."""
+    # Older results, saved before the options existed, used neither.
+    return (r['corpus'], r['scale'], r.get('draft', False),
+            r.get('paragraph_cache', True))
+
+def compare(results, old_results):
+    """Print each run's time as a ratio of the same run in `old_results`.
+
+    Runs are only compared with runs of the same corpus and scale that
+    used the same options.
+
+    """
+    old_runs = {run_key(r): r for r in old_results['runs']}
+    for r in results['runs']:
+        old = old_runs.get(run_key(r))
+        if old is None:
+            print('{:8} x{:<4} no old run with the same options'.format(
+                r['corpus'], r['scale']))
+            continue
+        ratios = ['total {:.2f}x'.format(r['seconds'] / old['seconds'])]
+        for stage, seconds in r['stages'].items():
+            old_seconds = old['stages'].get(stage)
+            if old_seconds:
+                ratios.append('{} {:.2f}x'.format(stage,
+                                                  seconds / old_seconds))
+        print('{:8} x{:<4} vs old: {}'.format(r['corpus'], r['scale'],
+                                              '  '.join(ratios)))
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--corpus', nargs='+', choices=sorted(CORPORA),
+                        default=sorted(CORPORA),
+                        help='corpora to run (default: all)')
+    parser.add_argument('--scale', nargs='+', type=int, default=[1, 4],
+                        help='scales to run each corpus at (default 1 4)')
+    parser.add_argument('--no-paragraph-cache', action='store_true',
+                        help='turn off the paragraph cache while composing')
+    parser.add_argument('--draft', action='store_true',
+                        help='compose drafts, breaking lines first-fit')
+    parser.add_argument('--json', metavar='PATH',
+                        help='save the results as JSON to PATH')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='compare with results saved earlier')
+    args = parser.parse_args(argv)
+
+    with open(STEAM_PATH) as f:
+        essay = f.read()
+
+    results = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs': [],
+    }
+    for corpus in args.corpus:
+        for scale in args.scale:
+            r = run(corpus, scale, essay, not args.no_paragraph_cache,
+                    args.draft)
+            results['runs'].append(r)
+            stages = '  '.join('{} {:.3f}'.format(stage, seconds)
+                               for stage, seconds in r['stages'].items())
+            print('{:8} x{:<4} {:6} paragraphs {:5} pages  {:8.1f} par/s'
+                  ' {:7.2f} pages/s  peak {:6.1f} MB  {:5} failed'.format(
+                      corpus, scale, r['paragraphs'], r['pages'],
+                      r['paragraphs_per_second'], r['pages_per_second'],
+                      r['peak_memory_mb'], r['breaking']['failed']))
+            print('{:15} seconds: {}'.format('', stages))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
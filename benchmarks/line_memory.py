@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Compare the memory held by a chain of `Line` objects with a `LineStore`.
+
+Composes a long document of short fake paragraphs twice -- once with
+plain lines, and once into a `LineStore` that is then compacted -- and
+reports the memory that each finished document still holds, and the
+peak reached while composing it, as measured by `tracemalloc`, along
+with the time each takes when not being traced.
+
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+sys.setrecursionlimit(100000)
+
+from typesetting.composing import compose
+from typesetting.linestore import LineStore
+from typesetting.skeleton import single_column_layout
+
+def fake_paragraph(actions, a, fonts, line, next_line, n):
+    for i in range(n):
+        line = next_line(line, 2, 10)
+        line.graphics.append(('texts', [(0.0, 'roman', 'word%d' % i)]))
+    return a + 1, line
+
+def measure(function):
+    # Timed apart from the memory, since tracemalloc slows down every
+    # allocation, and so penalizes whichever makes the most of them.
+    gc.collect()
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    result = function()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak, seconds
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--paragraphs', type=int, default=20000,
+                        help='number of paragraphs (default 20000)')
+    args = parser.parse_args(argv)
+
+    actions = [(fake_paragraph, 3 + i % 5) for i in range(args.paragraphs)]
+    next_line = single_column_layout(432, 648, 72, 72, 72, 72)
+
+    def plain():
+        return compose(actions, None, None, next_line)
+
+    def stored():
+        store = LineStore()
+        end_line = compose(actions, None, None, store.layout(next_line))
+        return store.compact(end_line)
+
+    for name, function in ('Line chain', plain), ('LineStore', stored):
+        result, current, peak, seconds = measure(function)
+        print('{:12} held {:8.1f} MB  peak {:8.1f} MB  {:6.2f} s'.format(
+            name, current / 1e6, peak / 1e6, seconds))
+        del result
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -8,10 +8,10 @@ from PySide2.QtWidgets import QApplication
 
 from typesetting.composing import (
     avoid_widows_and_orphans, centered_paragraph,
-    compose, section_break, vskip,
+    compose_pages, section_break, vskip,
 )
 from typesetting.knuth import knuth_paragraph
-from typesetting.skeleton import single_column_layout, unroll
+from typesetting.skeleton import single_column_layout
 from typesetting.writer_qt import QtWriter
 
 INCH = 72
@@ -60,23 +60,18 @@ def main(argv):
         ('roman', 'Gentium Basic', 'Regular', 12),
     ])
 
-    end_line = compose(actions, fonts, None, next_line)
-    lines = unroll(None, end_line)[1:]  # TODO: handle None case better?
+    pages = compose_pages(actions, fonts, None, next_line)
 
-    current_page = lines[0].column.page
-    page_no = 1
-
-    for line in lines:
-        if line.column.page is not current_page:
-            current_page = line.column.page
+    for page_no, (page, lines) in enumerate(pages, 1):
+        if page_no > 1:
             writer.new_page()
-            page_no += 1
-            draw_header_and_footer(current_page, page_no, fonts, writer)
-        for graphic in line.graphics:
-            function, *args = graphic
-            if function == 'texts':
-                function = draw_texts
-            function(fonts, line, writer, *args)
+            draw_header_and_footer(page, page_no, fonts, writer)
+        for line in lines:
+            for graphic in line.graphics:
+                function, *args = graphic
+                if function == 'texts':
+                    function = draw_texts
+                function(fonts, line, writer, *args)
 
 def parse_essay(text, my_break):
     sections = text.strip().split('\n\n\n')
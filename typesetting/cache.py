@@ -0,0 +1,55 @@
+"""A small least-recently-used cache that counts its hits and misses."""
+
+from collections import OrderedDict
+
+class LRUCache(object):
+    """Remember up to `maxsize` values, discarding the least recently used.
+
+    A `maxsize` of zero turns the cache off.  The `hits` and `misses`
+    attributes count the lookups that found, and failed to find, a
+    value.
+
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def get(self, key, default=None):
+        """Return the value cached for `key`, or `default` if none is."""
+        try:
+            value = self._values[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._values.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Cache `value` for `key`, evicting old values if the cache is full."""
+        if self.maxsize <= 0:
+            return
+        values = self._values
+        values[key] = value
+        values.move_to_end(key)
+        while len(values) > self.maxsize:
+            values.popitem(last=False)
+
+    def clear(self):
+        """Discard every cached value and reset the counters."""
+        self._values.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """Return a dict of the cache's counters and size."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._values), 'maxsize': self.maxsize}
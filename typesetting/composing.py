@@ -1,17 +1,255 @@
 import sys
-from .skeleton import unroll
+from functools import partial
+from .skeleton import Line, count_lines, nth_line, place_galley, unroll
+
+# The memo and profiler of the compose() that is running, if any, and
+# whether it is a draft.  Memo keys start with `_memo_scope`, an object
+# made afresh by each compose(), so that a memo shared between them
+# never returns lines made from other actions or fonts.
+_memo = None
+_memo_scope = None
+_profiler = None
+_draft = False
+
+def compose(actions, fonts, line, next_line, memo=None, profiler=None,
+            draft=False):
+    """Run `actions` in order, returning the last line they produce.
+
+    If a `memo` is given, like a `typesetting.cache.LRUCache`, then
+    `call_action()` remembers the lines each action produces, so that
+    running an action again from an equivalent line with equivalent
+    layout constraints -- as `section_break()` and `section_title()`
+    do when trying out alternatives -- copies the lines instead.  Its
+    `hits` count the action runs that were avoided.  Lines are only
+    reused within this one call to compose().
+
+    If a `profiler`, like a `typesetting.profiling.Profiler`, is given,
+    then every action run is reported to it.
+
+    If `draft` is true, the document is composed quickly for a preview:
+    `knuth_paragraph()` breaks lines first-fit instead of optimally, and
+    `section_break()`, `section_title()`, and
+    `avoid_widows_and_orphans()` place what follows them once, without
+    trying it out first.
 
-def compose(actions, fonts, line, next_line):
+    """
+    global _memo, _memo_scope, _profiler, _draft
+    outer = _memo, _memo_scope, _profiler, _draft
+    _memo = memo
+    _memo_scope = object()
+    _profiler = profiler
+    _draft = draft
+    try:
+        a = 0
+        while a < len(actions):
+            a, line = call_action(actions, a, fonts, line, next_line)
+    finally:
+        _memo, _memo_scope, _profiler, _draft = outer
+    return line
+
+def current_profiler():
+    """Return the profiler of the running compose(), or None."""
+    return _profiler
+
+def drafting():
+    """Return whether the running compose() is a draft."""
+    return _draft
+
+run = compose  # compatibility
+
+def compose_pages(actions, fonts, line, next_line):
+    """Run `actions`, generating ``(page, lines)`` as each page is finished.
+
+    A page is finished once an action ends on a later page, since
+    actions only ever add lines after the last one.  Rather than keep
+    the whole document alive through the `previous` links of its
+    lines, the lines still being composed are copied after each page
+    is generated, so that the first of them has no `previous` line.
+
+    """
+    root = line
+    page = None if line is None else line.column.page
     a = 0
     while a < len(actions):
         a, line = call_action(actions, a, fonts, line, next_line)
+        if line is root or line.column.page is page:
+            continue
+        page = line.column.page
+        lines = unroll(root, line)[1:]
+        i = len(lines)
+        while i and lines[i - 1].column.page is page:
+            i -= 1
+        if i:
+            yield from _group_by_page(lines[:i])
+            line = _copy_lines(lines[i - 1], line, None)
+            root = None
+    if line is not root:
+        yield from _group_by_page(unroll(root, line)[1:])
+
+def _group_by_page(lines):
+    start = 0
+    for i, line in enumerate(lines):
+        if line.column.page is not lines[start].column.page:
+            yield lines[start].column.page, lines[start:i]
+            start = i
+    yield lines[start].column.page, lines[start:]
+
+def call_action(actions, a, fonts, line, next_line):
+    action, *args = actions[a]
+    if _profiler is None:
+        if _memo is None:
+            return action(actions, a, fonts, line, next_line, *args)
+        return _call_memoized(action, args, actions, a, fonts, line,
+                              next_line)
+    if _memo is None:
+        return _profile(action, actions, a, line, action,
+                        actions, a, fonts, line, next_line, *args)
+    return _profile(action, actions, a, line, _call_memoized,
+                    action, args, actions, a, fonts, line, next_line)
+
+def _profile(action, actions, a, line, function, *args):
+    """Call ``function(*args)`` as a run of `action`, starting after `line`.
+
+    The run is reported to the profiler, which there must be.
+
+    """
+    span = _profiler.begin_action(action, actions, a)
+    try:
+        a2, end_line = function(*args)
+    except BaseException:
+        _profiler.end_action(span, 0)
+        raise
+    _profiler.end_action(span, count_lines(line, end_line))
+    return a2, end_line
+
+def _call_memoized(action, args, actions, a, fonts, line, next_line):
+    constraints = _constraints(next_line, line)
+    if line is None:
+        state = None
+    elif _NEW_COLUMN in constraints:
+        # The first line starts a new column wherever `line` ends.
+        state = line.column, None
+    else:
+        state = line.column, line.y
+    key = _memo_scope, a, state, constraints
+    value = _memo.get(key)
+    if value is not None:
+        start_line, a2, end_line = value
+        end_line = _copy_lines(start_line, end_line, line)
+        if end_line is not None:
+            return a2, end_line
+    a2, end_line = action(actions, a, fonts, line, next_line, *args)
+    _memo.set(key, (line, a2, end_line))
+    return a2, end_line
+
+def _constraints(next_line, line):
+    """Describe what `next_line` will do with the lines after `line`.
+
+    Wrappers like the one returned by `add_leading()` describe
+    themselves with a `wrapping` attribute: a function returning the
+    next_line they wrap, the line they treat differently (or None if
+    they treat every line the same way), and a hashable key for what
+    they do.  A wrapper aimed at a line other than `line` can never see
+    its target, so it is left out.  Any other next_line is assumed to
+    place each line by looking only at the column and y of the line
+    before it.
+
+    """
+    keys = []
+    wrapping = getattr(next_line, 'wrapping', None)
+    while wrapping is not None:
+        next_line, target, key = wrapping()
+        if target is None or target is line:
+            keys.append(key)
+        wrapping = getattr(next_line, 'wrapping', None)
+    keys.append(next_line)
+    return tuple(keys)
+
+def _copy_lines(start_line, end_line, line, copies=None):
+    """Copy the lines after `start_line` through `end_line` on to `line`.
+
+    The copies of lines that shared the column of `start_line` share
+    the column of `line` instead.  Returns the copy of `end_line`, or
+    None if `end_line` does not follow `start_line`.  If a `copies`
+    dict is given, it is filled in with each copy, keyed by the id of
+    the line it copies.
+
+    """
+    lines = []
+    while end_line is not start_line:
+        if end_line is None:
+            return None
+        lines.append(end_line)
+        end_line = end_line.previous
+    old_column = None if start_line is None else start_line.column
+    for line2 in reversed(lines):
+        column = line2.column
+        if column is old_column:
+            column = line.column
+        line = Line(line, column, line2.y, list(line2.graphics))
+        if copies is not None:
+            copies[id(line2)] = line
     return line
 
-run = compose  # compatibility
+def call_action_with_reflow(actions, a, fonts, line, next_line):
+    """Call action `a`, and also return a function that places it again.
 
-def call_action(actions, a, fonts, line, next_line):
+    Returns ``(a2, end_line, reflow)``, where ``reflow(next_line2)``
+    returns what the action would have returned had it been called
+    with `next_line2` instead.  If the action has a `galley` attribute
+    -- a function taking the same arguments that returns ``(a2,
+    galley)`` -- then its lines are only broken once, and a reflow
+    merely places them again; it is rerun only if its first line lands
+    in a column of a different width.
+
+    """
     action, *args = actions[a]
-    return action(actions, a, fonts, line, next_line, *args)
+    galley_function = _galley_function(action)
+    if galley_function is None:
+        def reflow(next_line2):
+            return call_action(actions, a, fonts, line, next_line2)
+
+        a2, end_line = reflow(next_line)
+        return a2, end_line, reflow
+
+    # Breaking the galley and placing it counts as a run of the action,
+    # and so does each placement after that.
+    a2 = galley = None
+
+    def place(next_line2):
+        first_line = next_line2(line, galley.leading, galley.height)
+        if first_line.column.width != galley.width:
+            return call_action(actions, a, fonts, line, next_line2)
+        return a2, place_galley(galley, line, next_line2)
+
+    def run():
+        nonlocal a2, galley
+        a2, galley = galley_function(actions, a, fonts, line, next_line,
+                                     *args)
+        return place(next_line)
+
+    def reflow(next_line2):
+        if _profiler is None:
+            return place(next_line2)
+        return _profile(action, actions, a, line, place, next_line2)
+
+    if _profiler is None:
+        a3, end_line = run()
+    else:
+        a3, end_line = _profile(action, actions, a, line, run)
+    return a3, end_line, reflow
+
+def _galley_function(action):
+    if isinstance(action, partial):
+        function = getattr(action.func, 'galley', None)
+        if function is not None:
+            function = partial(function, *action.args, **action.keywords)
+        return function
+    return getattr(action, 'galley', None)
+
+# The constraint of a next_line that moves the line after its target to
+# a new column.
+_NEW_COLUMN = ('new_column',)
 
 def add_leading(line, next_line, leading=9999999):
     """Add `leading` points to the leading of the first line after `line`."""
@@ -19,6 +257,18 @@ def add_leading(line, next_line, leading=9999999):
         if line2 is line:
             leading2 += leading
         return next_line(line2, leading2, height)
+    # Leading this large always starts a new column.
+    key = _NEW_COLUMN if leading >= 9999999 else ('add_leading', leading)
+    next_line2.wrapping = lambda: (next_line, line, key)
+    return next_line2
+
+def _new_column_after(line, next_line):
+    """Return a next_line that starts a new column after `line`."""
+    def next_line2(line2, leading, height):
+        if line2 is line:
+            leading = 9999999
+        return next_line(line2, leading, height)
+    next_line2.wrapping = lambda: (next_line, line, _NEW_COLUMN)
     return next_line2
 
 def vskip(actions, a, fonts, line, next_line, leading):
@@ -30,10 +280,7 @@ def new_page(actions, a, fonts, line, next_line):
     """Action: moves the next generated line onto a new page."""
     if line is None:
         return a + 1, line
-    def next_line2(line2, leading, height):
-        if line2 is line:
-            leading = 9999999
-        return next_line(line2, leading, height)
+    next_line2 = _new_column_after(line, next_line)
     return call_action(actions, a + 1, fonts, line, next_line2)
 
 def new_recto_page(actions, a, fonts, line, next_line):
@@ -43,6 +290,101 @@ def new_recto_page(actions, a, fonts, line, next_line):
         line = next_line(line, 9999999, 0)
     return new_page(actions, a, fonts, line, next_line)
 
+def compose_parallel(actions, fonts, line, layout, processes=None):
+    """Compose `actions` like `compose()`, using a pool of processes.
+
+    The actions are split before each `new_page()` and
+    `new_recto_page()`, and each piece is composed by a worker process
+    that calls `layout()` for a fresh next_line; so the actions, the
+    fonts, and `layout` (like ``functools.partial(single_column_layout,
+    ...)``) must all be picklable.  The pieces are then stitched
+    together in order, with each piece's columns replaced by the ones
+    that really follow, so that their ids, and their margins, run on
+    from the piece before.  A blank page goes before a
+    `new_recto_page()` that would otherwise start on a verso.
+
+    A piece is instead composed here, like `compose()` would, if a
+    worker's columns turn out to have a different size than the
+    columns it really lands in, or if its last action runs on into
+    the next piece, as `vskip()` does; composing then carries on here
+    until it reaches the start of a piece again.
+
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    next_line = layout()
+    starts = [a for a, action in enumerate(actions) if a == 0
+              or action[0] is new_page or action[0] is new_recto_page]
+    stops = starts[1:] + [len(actions)]
+
+    with ProcessPoolExecutor(processes) as executor:
+        futures = {start: (stop, executor.submit(
+            _compose_piece, layout, actions, fonts, start, stop))
+                   for start, stop in zip(starts, stops)
+                   if start or line is None}
+        pieces = {start: (stop, future.result())
+                  for start, (stop, future) in futures.items()}
+
+    a = 0
+    while a < len(actions):
+        piece = pieces.get(a)
+        if piece is not None and (a == 0 or line is not None):
+            stop, (a2, lines) = piece
+            # A piece whose last action ran on into the next piece did
+            # so from a column the worker made up, so it is composed
+            # here instead, on until a piece lines up again.
+            if a2 == stop:
+                if (a and actions[a][0] is new_recto_page
+                        and line.column.id % 2):
+                    line = next_line(line, 9999999, 0)
+                end_line = _stitch(line, lines, next_line)
+                if end_line is not None:
+                    a, line = a2, end_line
+                    continue
+        a, line = call_action(actions, a, fonts, line, next_line)
+    return line
+
+def _compose_piece(layout, actions, fonts, start, stop):
+    """Compose actions `start` up to `stop` in a worker process.
+
+    Returns the index of the next action, and a list of ``(column, y,
+    graphics)`` tuples for the lines, since a long chain of lines would
+    make too deep a recursion for pickle.
+
+    """
+    next_line = layout()
+    if start:
+        # Start from a full column before column 1, as though the
+        # previous piece had just ended.
+        column = next_line(None, 0, 0).column._replace(id=0)
+        line = first_line = Line(None, column, column.height, [])
+        a, line = new_page(actions, start, fonts, line, next_line)
+    else:
+        line = first_line = None
+        a = 0
+    while a < stop:
+        a, line = call_action(actions, a, fonts, line, next_line)
+    lines = unroll(first_line, line)[1:]
+    return a, [(line.column, line.y, line.graphics) for line in lines]
+
+def _stitch(line, lines, next_line):
+    """Add `lines` from `_compose_piece()` after `line`, in new columns.
+
+    Returns the last line, or None if a column does not fit.
+
+    """
+    columns = {}
+    for column, y, graphics in lines:
+        new_column = columns.get(id(column))
+        if new_column is None:
+            new_column = next_line(line, 9999999, 0).column
+            if (new_column.width, new_column.height) != (
+                    column.width, column.height):
+                return None
+            columns[id(column)] = new_column
+        line = Line(line, new_column, y, graphics)
+    return line
+
 def blank_line(actions, a, fonts, line, next_line, graphic):
     line2 = next_line(line, 2, 10)
     if line2.column is not line.column:
@@ -80,11 +422,17 @@ def section_break(actions, a, fonts, line, next_line, font_name, graphic):
         line3 = next_line(line2, leading, height)
         return a1, line3
 
+    if _draft:
+        # Rather than try out the following content, guess that it
+        # starts with a line like the blank one, and show the graphic
+        # if that line would land on the next page.
+        if next_line(line2, leading, height).column is not line2.column:
+            line2.graphics.append(graphic)
+        return a1, line2
+
     # See what the following content does after the blank line.
     a2, line3 = call_action(actions, a1, fonts, line2, next_line)
-    lines = unroll(line2, line3)
-    assert line2 is lines[0]
-    if line2.column is lines[1].column:
+    if line2.column is nth_line(line2, line3, 1).column:
         # A simple blank line works! The following content (at least its
         # first line) stayed here on the same page.
         return a2, line3
@@ -117,7 +465,8 @@ def section_title(actions, a, fonts, line, next_line):
     if a1 == len(actions):
         return a1, line
 
-    a2, title_line = call_action(actions, a1, fonts, line, next_line)
+    a2, title_line, reflow_title = call_action_with_reflow(
+        actions, a1, fonts, line, next_line)
     if title_line is line:
         _die(
             'The action', actions[a], 'expects to be followed by an action',
@@ -125,22 +474,26 @@ def section_title(actions, a, fonts, line, next_line):
             actions[a1:a2], 'did not generate a line.',
         )
 
+    first_line_of_title = nth_line(line, title_line, 1)
+    if _draft:
+        # Rather than run the following action, move the title unless
+        # it already starts a column, or it fits in this one along with
+        # a line as tall as its first.
+        if line is None or line.column is not first_line_of_title.column:
+            return a2, title_line
+        step = first_line_of_title.y - line.y
+        if (title_line.column is line.column and
+                next_line(title_line, 0, step).column is line.column):
+            return a2, title_line
+        return reflow_title(_new_column_after(line, next_line))
+
     a3, following_line = call_action(actions, a2, fonts, title_line, next_line)
-    lines1 = unroll(line, title_line)
-    lines2 = unroll(title_line, following_line)
-    first_line_of_title = lines1[1]
-    line_after_title = lines2[1]
+    line_after_title = nth_line(title_line, following_line, 1)
     if first_line_of_title.column is line_after_title.column:
         return a3, following_line
 
     # Otherwise, move the title to the top of the next column.
-    def next_line2(line2, leading, height):
-        if line2 is line:
-            leading = 9999999
-        return next_line(line2, leading, height)
-
-    a2, title_line = call_action(actions, a1, fonts, line, next_line2)
-    return a2, title_line
+    return reflow_title(_new_column_after(line, next_line))
 
 def avoid_widows_and_orphans(actions, a, fonts, line, next_line):
     """Position the following action’s output to avoid widows and orphans.
@@ -151,34 +504,38 @@ def avoid_widows_and_orphans(actions, a, fonts, line, next_line):
     trying to avoid both inevitably produces one or the other.
 
     """
-    a2, end_line = call_action(actions, a + 1, fonts, line, next_line)
-    lines = unroll(line, end_line)
+    if _draft:
+        return call_action(actions, a + 1, fonts, line, next_line)
+
+    a2, end_line, place_again = call_action_with_reflow(
+        actions, a + 1, fonts, line, next_line)
 
     # Single-line paragraphs produce neither widows nor orphans.
-    if len(lines) == 2:  # INVALID: lines might have come from something else?
+    if count_lines(line, end_line) == 1:  # INVALID: lines might have come from something else?
         return a2, end_line  # TODO: untested
 
     original_a2 = a2
     original_end_line = end_line
 
+    def lines(n):
+        return nth_line(line, end_line, n)
+
     def reflow():
-        nonlocal end_line, lines
-        a2, end_line = call_action(actions, a + 1, fonts, line, fancy_next_line)
-        lines = unroll(line, end_line)
+        nonlocal a2, end_line
+        a2, end_line = place_again(fancy_next_line)
 
     def is_orphan():
-        return lines[1].column is not lines[2].column
+        return lines(1).column is not lines(2).column
 
     def fix_orphan():
-        skips.add((lines[1].column.id, lines[1].y))
+        skips.add((lines(1).column.id, lines(1).y))
         reflow()
 
     def is_widow():
-        return lines[-2].column is not lines[-1].column
+        return lines(-2).column is not lines(-1).column
 
     def fix_widow():
-        nonlocal end_line, lines
-        skips.add((lines[-2].column.id, lines[-2].y))
+        skips.add((lines(-2).column.id, lines(-2).y))
         reflow()
 
     def fancy_next_line(line, leading, height):
@@ -188,6 +545,8 @@ def avoid_widows_and_orphans(actions, a, fonts, line, next_line):
         return line2
 
     skips = set()
+    fancy_next_line.wrapping = lambda: (
+        next_line, None, ('skips', frozenset(skips)))
 
     if is_orphan():
         fix_orphan()
@@ -0,0 +1,158 @@
+"""Compose a document again after an edit, redoing as little as possible.
+
+`compose_with_checkpoints()` composes a document like `compose()`, but
+also remembers the line that each top-level action started from.  When
+some of the actions are later edited, `recompose()` restarts from the
+checkpoint before the first edit, and stops as soon as an unedited
+action starts from the same column and y as it did last time, copying
+the rest of the old lines instead of composing them again::
+
+    composition = compose_with_checkpoints(actions, fonts, None, next_line)
+    ...
+    composition, changed = recompose(composition, new_actions, fonts,
+                                     next_line)
+
+Like the memo of `compose()`, this assumes that what an action does
+depends only on the column and y of the line it starts from.
+
+"""
+from collections import namedtuple
+
+from .composing import _copy_lines, call_action
+
+# The state of the layout before the top-level action `a`: the `line`
+# it started from, and the highest action index it looked at, since
+# actions like `section_break()` peek at the actions that follow them.
+Checkpoint = namedtuple('Checkpoint', 'a line reach')
+
+# A composed document: its actions, a checkpoint for each of its
+# top-level actions, and its last line.
+Composition = namedtuple('Composition', 'actions checkpoints end_line')
+
+class _WatchedActions(list):
+    """A list of actions that remembers the highest index looked up.
+
+    Asking for its length counts as looking up the index after the
+    highest one looked up so far, since that is what an action learns
+    when it compares its next index with the length, as
+    `section_break()` does to see whether it comes last; for the last
+    action, this index is the length itself, so appending actions
+    sends `recompose()` back to it.
+
+    """
+    reach = -1
+
+    def __getitem__(self, index):
+        if isinstance(index, int) and index > self.reach:
+            self.reach = index
+        return list.__getitem__(self, index)
+
+    def __len__(self):
+        length = list.__len__(self)
+        if self.reach < length:
+            self.reach += 1
+        return length
+
+def compose_with_checkpoints(actions, fonts, line, next_line):
+    """Compose `actions` and return a `Composition` of the result."""
+    actions = _WatchedActions(actions)
+    checkpoints = []
+    a, end_line = _run(actions, 0, fonts, line, next_line, checkpoints)
+    return Composition(list(actions), checkpoints, end_line)
+
+def recompose(composition, actions, fonts, next_line):
+    """Compose an edited list of `actions` again.
+
+    Returns ``(composition, changed)``, where `changed` is None if no
+    line changed, or else the ids ``(first, last)`` of the first and
+    last columns whose lines changed (with one column per page, as in
+    `single_column_layout()`, these are page numbers).  The `fonts` and
+    `next_line` must be the same ones that composed `composition`.
+
+    """
+    old_actions = composition.actions
+    actions = _WatchedActions(actions)
+    length = min(len(old_actions), len(actions))
+    first = 0
+    while first < length and old_actions[first] == actions[first]:
+        first += 1
+    if first == length and len(old_actions) == len(actions):
+        return composition, None
+    same = 0
+    while (same < length - first
+           and old_actions[-1 - same] == actions[-1 - same]):
+        same += 1
+
+    # Restart from the first action that looked at the first edit.
+    checkpoints = composition.checkpoints
+    k = 0
+    while k < len(checkpoints) and checkpoints[k].reach < first:
+        k += 1
+    if k < len(checkpoints):
+        start = checkpoints[k]
+    else:
+        start = Checkpoint(len(old_actions), composition.end_line, -1)
+    new_checkpoints = checkpoints[:k]
+
+    # Compose until an unedited action starts where it started before.
+    offset = len(actions) - len(old_actions)
+    old_at = {checkpoint.a: i for i, checkpoint in enumerate(checkpoints)}
+    unedited = len(actions) - same
+
+    def resync(a, line):
+        i = old_at.get(a - offset)
+        return (a >= unedited and i is not None and i >= k
+                and _same_place(line, checkpoints[i].line))
+
+    a, line = _run(actions, start.a, fonts, start.line, next_line,
+                   new_checkpoints, resync)
+    if a < len(actions):
+        # Copy the old lines that follow on to the line that matched.
+        i = old_at[a - offset]
+        old_line = checkpoints[i].line
+        copies = {id(old_line): line}
+        end_line = _copy_lines(old_line, composition.end_line, line, copies)
+        for checkpoint in checkpoints[i:]:
+            new_checkpoints.append(Checkpoint(
+                checkpoint.a + offset, copies[id(checkpoint.line)],
+                checkpoint.reach + offset))
+    else:
+        old_line = composition.end_line
+        end_line = line
+
+    # Report the columns from the first line replaced or added through
+    # the last one.
+    first_lines = [_first_line_after(start.line, old_line),
+                   _first_line_after(start.line, line)]
+    ids = [l.column.id for l in first_lines if l is not None]
+    if not ids:
+        changed = None
+    else:
+        changed = min(ids), max(_column_id(old_line), _column_id(line))
+    return Composition(list(actions), new_checkpoints, end_line), changed
+
+def _run(actions, a, fonts, line, next_line, checkpoints, resync=None):
+    """Run actions from `a`, stopping early where `resync(a, line)`."""
+    while a < len(actions):
+        if resync is not None and resync(a, line):
+            break
+        actions.reach = a
+        a2, line2 = call_action(actions, a, fonts, line, next_line)
+        checkpoints.append(Checkpoint(a, line, actions.reach))
+        a, line = a2, line2
+    return a, line
+
+def _same_place(line, old_line):
+    if line is None or old_line is None:
+        return line is old_line
+    return line.y == old_line.y and line.column == old_line.column
+
+def _column_id(line):
+    return 0 if line is None else line.column.id
+
+def _first_line_after(start_line, end_line):
+    line = None
+    while end_line is not start_line:
+        line = end_line
+        end_line = end_line.previous
+    return line
@@ -1,71 +1,150 @@
 """Classes that support Knuth TeX-style paragraph breaking."""
 
 import re
-from .vendored.texlib_wrap import ObjectList, Box, Glue, Penalty
+from .cache import LRUCache
+from .composing import current_profiler, drafting
+from .skeleton import Galley, place_galley
+from .vendored.texlib_wrap import (
+    BOX, GLUE, PENALTY, BreakStats, PackedObjectList,
+)
 from .vendored.hyphenate import hyphenate_word
 
-_zero_width_break = Glue(0, 0, 0)
+# Tolerances to try, in order, when breaking a paragraph.
+_tolerances = 1, 2, 3, 4, 5, 6, 7  # TODO: went to 7 to avoid errors
+
+# Recently broken paragraphs; set its `maxsize` to 0 to turn it off.
+paragraph_cache = LRUCache(256)
 
 def knuth_paragraph(actions, a, fonts, line, next_line,
-                    indent, first_indent, fonts_and_texts):
+                    indent, first_indent, fonts_and_texts,
+                    pretolerance=None, vocabulary=None, max_active=None):
+    """Action: set text as a justified paragraph, TeX-style.
 
-    font_name = fonts_and_texts[0][0]
-    font = fonts[font_name]
-    width_of = font.width_of
+    If a `pretolerance` is given then, as in TeX, a first attempt is
+    made at breaking the paragraph without hyphenating any words, and
+    hyphenation runs only if no breaks are found within that tolerance.
+    To use a pretolerance throughout a document, supply the action as
+    ``functools.partial(knuth_paragraph, pretolerance=1)``.
+
+    A `vocabulary` from `typesetting.vocabulary` supplies words that
+    were hyphenated and measured ahead of time.
+
+    For very long paragraphs, `max_active` caps the active nodes that
+    line breaking keeps for each number of lines, which bounds its
+    work at a small risk of missing the best breaks.
+
+    In a draft `compose()`, lines are broken first-fit instead.
+
+    """
+    a2, galley = knuth_galley(actions, a, fonts, line, next_line, indent,
+                              first_indent, fonts_and_texts, pretolerance,
+                              vocabulary, max_active)
+    return a2, place_galley(galley, line, next_line)
 
+def knuth_galley(actions, a, fonts, line, next_line,
+                 indent, first_indent, fonts_and_texts,
+                 pretolerance=None, vocabulary=None, max_active=None):
+    """Break a `knuth_paragraph()` into a Galley without placing it.
+
+    The lines are remembered in `paragraph_cache`, so doing this again
+    for the same text at the same width (as happens when other actions
+    try out different placements) skips the breaking.
+
+    """
     # Design simplification: if any line will require extra leading,
     # then all lines are spaced farther apart.
     leading = max(fonts[name].leading for name, text in fonts_and_texts)
     height = max(fonts[name].height for name, text in fonts_and_texts)
 
-    line = next_line(line, leading, height)
-    line_lengths = [line.column.width]  # TODO: support interesting shapes
+    # Learn the width of the column where the paragraph will start.
+    width = next_line(line, leading, height).column.width
 
-    if first_indent is True:
-        first_indent = font.height
+    # The key holds the ids of the fonts, and the value holds the fonts
+    # themselves, so that no id can be reused while its entry is alive.
+    paragraph_fonts = tuple(fonts[name] for name, text in fonts_and_texts)
+    draft = drafting()
+    key = (tuple((name, text) for name, text in fonts_and_texts),
+           indent, first_indent, width, pretolerance, draft, max_active,
+           tuple(id(font) for font in paragraph_fonts))
+    value = paragraph_cache.get(key)
+    if value is None:
+        xlists = break_paragraph(fonts, width, indent, first_indent,
+                                 fonts_and_texts, pretolerance, vocabulary,
+                                 draft, max_active)
+        paragraph_cache.set(key, (paragraph_fonts, xlists))
+    else:
+        paragraph_fonts, xlists = value
 
-    olist = ObjectList()
-    # olist.debug = True
+    lines = [[('texts', xlist)] for xlist in xlists]
+    return a + 1, Galley(width, leading, height, lines)
 
-    if first_indent:
-        olist.append(Glue(first_indent, 0, 0))
+knuth_paragraph.galley = knuth_galley
+
+def break_paragraph(fonts, width, indent, first_indent, fonts_and_texts,
+                    pretolerance=None, vocabulary=None, draft=False,
+                    max_active=None):
+    """Break a paragraph into justified lines of the given `width`.
+
+    Returns a list with one item per line, each a list of ``(x,
+    font_name, text)`` tuples.  The arguments have the same meaning
+    as for `knuth_paragraph()`; if `draft` is true, the lines are
+    broken first-fit.
+
+    """
+    font_name = fonts_and_texts[0][0]
+    font = fonts[font_name]
+    width_of = font.width_of
+
+    line_lengths = [width]  # TODO: support interesting shapes
+
+    if first_indent is True:
+        first_indent = font.height
 
     # TODO: get rid of this since it changes with the font?  Compute
     # and pre-cache them in each metrics cache?
     space_width = width_of('m m') - width_of('mm')
 
     # TODO: should do non-breaking spaces with glue as well
-    space_glue = Glue(space_width, space_width * .5, space_width * .3333)
+    space_glue = (space_width, space_width * .5, space_width * .3333)
 
     indented_lengths = [length - indent for length in line_lengths]
 
-    for font_name, text in fonts_and_texts:
-        font = fonts[font_name]
-        width_of = font.width_of
-        boxes = break_text_into_boxes(text, font_name, width_of, space_glue)
-        olist.extend(boxes)
-
-    if olist[-1] is space_glue:
-        olist.pop()             # ignore trailing whitespace
-
-    olist.add_closing_penalty()
+    # A running profiler is told how hard the paragraph was to break.
+    profiler = current_profiler()
+    stats = None if profiler is None or draft else BreakStats()
+    breaks = None
 
-    for tolerance in 1, 2, 3, 4, 5, 6, 7:  # TODO: went to 7 to avoid errors
+    if draft:
+        olist = _build_object_list(fonts, fonts_and_texts, first_indent,
+                                   space_glue, hyphenate_word, vocabulary)
+        breaks = olist.compute_breakpoints_first_fit(indented_lengths)
+    elif pretolerance is not None:
+        olist = _build_object_list(fonts, fonts_and_texts, first_indent,
+                                   space_glue, None, vocabulary)
         try:
-            breaks = olist.compute_breakpoints(
-                indented_lengths, tolerance=tolerance)
+            breaks, tolerance = _compute_breakpoints(
+                olist, indented_lengths, (pretolerance,), stats, max_active)
         except RuntimeError:
             pass
-        else:
-            break
-    else:
-        print('FAIL')  # TODO
-        breaks = [0, len(olist) - 1]  # TODO
+
+    if breaks is None:
+        olist = _build_object_list(fonts, fonts_and_texts, first_indent,
+                                   space_glue, hyphenate_word, vocabulary)
+        try:
+            breaks, tolerance = _compute_breakpoints(
+                olist, indented_lengths, _tolerances, stats, max_active)
+        except RuntimeError:
+            print('FAIL')  # TODO
+            if stats is not None:
+                stats.failed += 1
+            breaks = [0, len(olist) - 1]  # TODO
+
+    if stats is not None:
+        profiler.add_break_stats(fonts_and_texts, stats)
 
     assert breaks[0] == 0
     start = 0
-
-    font = 'body-roman'
+    xlists = []
 
     for i, breakpoint in enumerate(breaks[1:]):
         r = olist.compute_adjustment_ratio(start, breakpoint, i,
@@ -76,23 +155,75 @@ def knuth_paragraph(actions, a, fonts, line, next_line,
         xlist = []
         x = 0
         for i in range(start, breakpoint):
-            box = olist[i]
-            if box.is_glue():
-                x += box.compute_width(r)
-            elif box.is_box():
-                font_name, text = box.content
+            kind = olist.kind[i]
+            if kind == GLUE:
+                x += olist.compute_glue_width(i, r)
+            elif kind == BOX:
+                font_name, text = olist.content[i]
                 xlist.append((x + indent, font_name, text))
-                x += box.width
+                x += olist.width[i]
 
-        bbox = olist[breakpoint]
-        if bbox.is_penalty() and bbox.width:
+        if olist.kind[breakpoint] == PENALTY and olist.width[breakpoint]:
             xlist.append((x + indent, font_name, '-'))
 
-        line.graphics.append(('texts', xlist))
-        line = next_line(line, leading, height)
+        xlists.append(xlist)
         start = breakpoint + 1
 
-    return a + 1, line.previous
+    return xlists
+
+def _compute_breakpoints(olist, line_lengths, tolerances, stats=None,
+                         max_active=None):
+    """Break `olist` at the first of `tolerances` that works.
+
+    The attempt is reported to the profiler of the running `compose()`,
+    if it has one, with the tolerance that worked, or None, and its
+    counts are added to the BreakStats `stats`.
+
+    """
+    profiler = current_profiler()
+    if profiler is None:
+        return olist.compute_breakpoints_escalating(
+            line_lengths, tolerances=tolerances, stats=stats,
+            max_active=max_active)
+    span = profiler.begin_span('compute_breakpoints',
+                               tolerances=list(tolerances))
+    call_stats = BreakStats()
+    tolerance = None
+    try:
+        breaks, tolerance = olist.compute_breakpoints_escalating(
+            line_lengths, tolerances=tolerances, stats=call_stats,
+            max_active=max_active)
+    finally:
+        profiler.end_span(span, tolerance=tolerance, **call_stats.as_dict())
+        if stats is not None:
+            stats.add(call_stats)
+    return breaks, tolerance
+
+def _build_object_list(fonts, fonts_and_texts, first_indent, space_glue,
+                       hyphenate, vocabulary=None):
+    olist = PackedObjectList()
+    # olist.debug = True
+
+    if first_indent:
+        olist.append_glue(first_indent, 0, 0)
+
+    space_at = None
+    for font_name, text in fonts_and_texts:
+        font = fonts[font_name]
+        width_of = font.width_of
+        words = None
+        if vocabulary is not None:
+            words = vocabulary.words_for(font_name, font, hyphenate)
+        index = break_text_into_boxes(olist, text, font_name, width_of,
+                                      space_glue, hyphenate, words)
+        if index is not None:
+            space_at = index
+
+    if space_at == len(olist) - 1:
+        olist.pop()             # ignore trailing whitespace
+
+    olist.add_closing_penalty()
+    return olist
 
 # Regular expression that scans text for control codes, words, punction,
 # and runs of contiguous space.  If it works correctly, any possible
@@ -100,27 +231,63 @@ def knuth_paragraph(actions, a, fonts, line, next_line,
 # expression.
 _text_findall = re.compile(r'([\u00a0]?)(\w*)([^\u00a0\w\s]*)([ \n]*)').findall
 
-def break_text_into_boxes(text, font_name, width_of, space_glue):
+def break_text_into_boxes(olist, text, font_name, width_of, space_glue,
+                          hyphenate=hyphenate_word, words=None):
+    """Append the boxes, glue, and penalties that typeset `text` to `olist`.
+
+    The `space_glue` is a tuple ``(width, stretch, shrink)`` giving the
+    glue to use for each run of whitespace.  Words are split at the
+    points returned by `hyphenate`, or not at all if it is None.  If
+    given, `words` is a dict mapping ``(word, punctuation)`` to the
+    result of `measure_token()` for tokens measured in advance.
+
+    Returns the index in `olist` of the last space glue appended, or
+    None if there was none.
+
+    """
+    space_at = None
+    hyphen_width = width_of('-')
+    append_box = olist.append_box
+    append_glue = olist.append_glue
+    append_penalty = olist.append_penalty
     #print(repr(text))
     for control_code, word, punctuation, space in _text_findall(text):
         #print((control_code, word, punctuation, space))
         if control_code:
             if control_code == '\u00a0':
-                yield Penalty(0, 1000)
-                yield space_glue
+                append_penalty(0, 1000)
+                append_glue(*space_glue)
+                space_at = len(olist) - 1
             else:
                 print('Unsupported control code: %r' % control_code)
-        if word:
-            strings = hyphenate_word(word)
-            if punctuation:
-                strings[-1] += punctuation
-            for i, string in enumerate(strings):
+        if word or punctuation:
+            boxes = None
+            if words is not None:
+                boxes = words.get((word, punctuation))
+            if boxes is None:
+                boxes = measure_token(word, punctuation, width_of, hyphenate)
+            for i, (width, string) in enumerate(boxes):
                 if i:
-                    yield Penalty(width_of('-'), 100)
-                yield Box(width_of(string), (font_name, string))
-        elif punctuation:
-            yield Box(width_of(punctuation), (font_name, punctuation))
+                    append_penalty(hyphen_width, 100)
+                append_box(width, (font_name, string))
         if punctuation == '-':
-            yield _zero_width_break
+            append_glue(0, 0, 0)  # zero-width break
         if space:
-            yield space_glue
+            append_glue(*space_glue)
+            space_at = len(olist) - 1
+    return space_at
+
+def measure_token(word, punctuation, width_of, hyphenate=hyphenate_word):
+    """Return a tuple of ``(width, string)`` boxes that typeset a token.
+
+    The `word` is split at the points returned by `hyphenate`, unless
+    it is None, and any `punctuation` joins the final piece.
+
+    """
+    if not word:
+        strings = (punctuation,)
+    else:
+        strings = hyphenate(word) if hyphenate else (word,)
+        if punctuation:
+            strings = [*strings[:-1], strings[-1] + punctuation]
+    return tuple((width_of(string), string) for string in strings)
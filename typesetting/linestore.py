@@ -0,0 +1,276 @@
+"""A compact, array-backed home for the lines of a very long document.
+
+Each `Line` is a namedtuple with its own `graphics` list, so a book of
+thousands of pages becomes millions of small objects.  A `LineStore`
+instead keeps each line's previous line, column, y, number, and jump
+link in typed arrays, and hands out `StoredLine` views that actions
+can use wherever they expect a `Line`::
+
+    store = LineStore()
+    end_line = compose(actions, fonts, None, store.layout(next_line))
+    lines = store.compact(end_line)
+
+A line is added straight to the arrays, without making a `Line`, when
+its next_line has a `place` attribute, as those of
+`single_column_layout()` do.  Columns are interned as they are added,
+so the attempts that actions like `section_break()` make at the same
+column share it, and a line's graphics list is only made once it is
+asked for.  Only the views still in use are kept, in a weak
+dictionary, so that the same line is always the same view while
+anything holds it.
+
+While a document is composed, its store also holds the lines of every
+attempt that actions like `section_break()` threw away; `compact()`
+copies just the final chain of lines into a new store, with their
+pages interned and their graphics packed end to end in a single list.
+The views of a compacted store are read-only: asking for a line's
+`graphics` returns a new list.  And a compacted store makes a new
+view each time a line is asked for, so its views should be compared
+by `index`.
+
+Since equal pages share a single interned `Page`, the pages of a
+compacted store are told apart by `page_number()` rather than by
+identity.
+
+"""
+from array import array
+from weakref import WeakValueDictionary
+
+from .skeleton import Column
+
+class StoredLine(object):
+    """A view of one line of a `LineStore`, standing in for a `Line`."""
+    __slots__ = ('store', 'index', '__weakref__')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    @property
+    def previous(self):
+        return self.store.line(self.store.previous[self.index])
+
+    @property
+    def column(self):
+        return self.store.columns[self.store.column[self.index]]
+
+    @property
+    def y(self):
+        return self.store.y[self.index]
+
+    @property
+    def graphics(self):
+        return self.store.graphics_of(self.index)
+
+    @property
+    def number(self):
+        return self.store.number[self.index]
+
+    @property
+    def jump(self):
+        return self.store.line(self.store.jump[self.index])
+
+    def __repr__(self):
+        return 'StoredLine(index={}, column={!r}, y={!r})'.format(
+            self.index, self.column, self.y)
+
+class LineStore(object):
+    """Lines kept in typed arrays, with a `StoredLine` view for each."""
+
+    def __init__(self):
+        self.previous = array('i')
+        self.column = array('i')
+        self.y = array('d')
+        self.number = array('i')
+        self.jump = array('i')
+        self.columns = []
+        self.column_pages = array('i')
+        self.pages = []
+        self._column_indexes = {}
+        self._graphics_lists = []
+        self._graphics = None
+        self._offsets = None
+        self._views = WeakValueDictionary()
+
+    def __len__(self):
+        return len(self.y)
+
+    def line(self, index):
+        """Return the view of line `index`, or None if it is -1."""
+        if index < 0:
+            return None
+        views = self._views
+        if views is None:
+            return StoredLine(self, index)
+        view = views.get(index)
+        if view is None:
+            view = views[index] = StoredLine(self, index)
+        return view
+
+    def lines(self):
+        """Generate a view of every line, in the order they were added."""
+        for index in range(len(self.y)):
+            yield self.line(index)
+
+    def graphics_of(self, index):
+        """Return the graphics list of line `index`."""
+        if self._offsets is not None:
+            offsets = self._offsets
+            return self._graphics[offsets[index]:offsets[index + 1]]
+        graphics = self._graphics_lists[index]
+        if graphics is None:
+            graphics = self._graphics_lists[index] = []
+        return graphics
+
+    def page_number(self, line):
+        """Return the page, counting from 0, of a line of a compacted store."""
+        return self.column_pages[self.column[line.index]]
+
+    def add(self, previous, column, y, graphics=None):
+        """Add a line after the view `previous`, returning its view."""
+        previous_index = -1 if previous is None else previous.index
+        index = self._add(previous_index, self._intern_column(column), y)
+        if graphics:
+            self._graphics_lists[index] = graphics
+        return self.line(index)
+
+    def _add(self, previous_index, column_index, y):
+        if previous_index < 0:
+            jump_index = -1
+            number = 1
+        else:
+            numbers = self.number
+            jumps = self.jump
+            jump_index = previous_index
+            number = numbers[previous_index] + 1
+            jump2 = jumps[previous_index]
+            if jump2 >= 0:
+                jump3 = jumps[jump2]
+                if jump3 >= 0 and (numbers[previous_index] - numbers[jump2]
+                                   == numbers[jump2] - numbers[jump3]):
+                    jump_index = jump3
+        index = len(self.y)
+        self.previous.append(previous_index)
+        self.column.append(column_index)
+        self.y.append(y)
+        self.number.append(number)
+        self.jump.append(jump_index)
+        self._graphics_lists.append(None)
+        return index
+
+    def layout(self, next_line):
+        """Wrap `next_line` so that the lines it makes are kept here.
+
+        A line that follows a line from somewhere else, like the copies
+        made by `compose_pages()`, is left as an ordinary `Line`.
+
+        """
+        place = getattr(next_line, 'place', None)
+        columns = self.columns
+
+        def next_line2(line, leading, height):
+            if line is None:
+                previous_index = -1
+                column_index = -1
+                column = y = None
+            elif isinstance(line, StoredLine) and line.store is self:
+                previous_index = line.index
+                column_index = self.column[previous_index]
+                column = columns[column_index]
+                y = self.y[previous_index]
+            else:
+                return next_line(line, leading, height)
+            if place is None:
+                line2 = next_line(line, leading, height)
+                column2 = line2.column
+                y2 = line2.y
+                graphics = line2.graphics
+            else:
+                column2, y2 = place(column, y, leading, height)
+                graphics = None
+            if column2 is not column:
+                column_index = self._intern_column(column2)
+            index = self._add(previous_index, column_index, y2)
+            if graphics:
+                self._graphics_lists[index] = graphics
+            return self.line(index)
+        return next_line2
+
+    def compact(self, end_line):
+        """Return a new store holding only the lines through `end_line`.
+
+        The lines are found by following `previous` from `end_line`, so
+        they may be views or ordinary `Line` objects.
+
+        """
+        # Ordinary lines can only follow the lines of this store, whose
+        # chain is then followed through the arrays without any views.
+        others = []
+        while end_line is not None and not (
+                isinstance(end_line, StoredLine) and end_line.store is self):
+            others.append(end_line)
+            end_line = end_line.previous
+        others.reverse()
+        indexes = array('i')
+        index = -1 if end_line is None else end_line.index
+        while index >= 0:
+            indexes.append(index)
+            index = self.previous[index]
+        indexes.reverse()
+
+        store = LineStore()
+        store._views = None
+        interned_pages = {}
+        page_indexes = {}
+        column_indexes = {}
+        graphics = []
+        offsets = array('i', [0])
+
+        def new_column_index(column):
+            column_index = column_indexes.get(column)
+            if column_index is None:
+                page = column.page
+                page_index = page_indexes.get(id(page))
+                if page_index is None:
+                    page_index = page_indexes[id(page)] = len(page_indexes)
+                interned = interned_pages.setdefault(page, page)
+                if interned is page:
+                    store.pages.append(page)
+                column_index = column_indexes[column] = store._intern_column(
+                    Column(interned, *column[1:]))
+                store.column_pages.append(page_index)
+            return column_index
+
+        previous_index = -1
+        stored_columns = {}
+        for index in indexes:
+            column_index = self.column[index]
+            new_index = stored_columns.get(column_index)
+            if new_index is None:
+                new_index = stored_columns[column_index] = new_column_index(
+                    self.columns[column_index])
+            previous_index = store._add(previous_index, new_index,
+                                        self.y[index])
+            if self._offsets is None:
+                line_graphics = self._graphics_lists[index]
+                if line_graphics:
+                    graphics.extend(line_graphics)
+            else:
+                graphics.extend(self.graphics_of(index))
+            offsets.append(len(graphics))
+        for line in others:
+            previous_index = store._add(previous_index,
+                                        new_column_index(line.column), line.y)
+            graphics.extend(line.graphics)
+            offsets.append(len(graphics))
+        store._graphics = graphics
+        store._offsets = offsets
+        store._graphics_lists = None
+        return store
+
+    def _intern_column(self, column):
+        index = self._column_indexes.get(column)
+        if index is None:
+            index = self._column_indexes[column] = len(self.columns)
+            self.columns.append(column)
+        return index
@@ -0,0 +1,112 @@
+"""Faster measurement of text, for any font backend.
+
+Layout asks a font for the width of every word, word fragment, and
+punctuation mark it sets, and backends like Qt charge a toll for each
+question.  A `CachedFont` wraps any font and remembers recent answers.
+An `AdvanceTable` goes further, learning the advance of each character
+and the kerning of each pair of characters once, after which most
+widths are simple arithmetic; since it records widths at unit size, a
+single table serves every size of a face, by way of `ScaledFont`.
+
+"""
+from .cache import LRUCache
+
+class CachedFont(object):
+    """Wrap a font so that its `width_of()` results are remembered.
+
+    Up to `maxsize` widths are kept, least recently used first out.
+    Other attributes are passed through to the wrapped `font`.
+
+    """
+    def __init__(self, font, maxsize=4096):
+        self.font = font
+        self.ascent = font.ascent
+        self.descent = font.descent
+        self.height = font.height
+        self.leading = font.leading
+        self.widths = LRUCache(maxsize)
+
+    def __getattr__(self, name):
+        font = self.__dict__.get('font')
+        if font is None or name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(font, name)
+
+    def width_of(self, text):
+        width = self.widths.get(text)
+        if width is None:
+            width = self.font.width_of(text)
+            self.widths.set(text, width)
+        return width
+
+class AdvanceTable(object):
+    """Character advances and pair kerning for a face, at unit size.
+
+    The `measure` function should return the width of a string when
+    set at the given `size`; the table only calls it for characters and
+    pairs of characters that it has not seen before.  Widths are stored
+    divided by `size`, so they need only be multiplied by a point size.
+    Note that this treats a string as the sum of its characters and
+    their pairwise kerning, so ligatures and other shaping are ignored.
+
+    """
+    def __init__(self, measure, size):
+        self.measure = measure
+        self.scale = 1.0 / size
+        self.advances = {}
+        self.kerning = {}
+
+    def advance(self, char):
+        """Return the unit-size advance of `char`."""
+        advance = self.advances.get(char)
+        if advance is None:
+            advance = self.advances[char] = self.measure(char) * self.scale
+        return advance
+
+    def kern(self, pair):
+        """Return the unit-size kerning between a two-character `pair`."""
+        kern = self.kerning.get(pair)
+        if kern is None:
+            kern = self.measure(pair) * self.scale - (
+                self.advance(pair[0]) + self.advance(pair[1]))
+            self.kerning[pair] = kern
+        return kern
+
+    def width_of(self, text):
+        """Return the unit-size width of `text`."""
+        advances = self.advances
+        kerning = self.kerning
+        width = 0.0
+        previous = None
+        for char in text:
+            advance = advances.get(char)
+            if advance is None:
+                advance = self.advance(char)
+            width += advance
+            if previous is not None:
+                pair = previous + char
+                kern = kerning.get(pair)
+                if kern is None:
+                    kern = self.kern(pair)
+                width += kern
+            previous = char
+        return width
+
+class ScaledFont(CachedFont):
+    """Wrap a font so that its widths come from a unit-size AdvanceTable.
+
+    Widths are the table's, times `size`, and are also remembered as
+    for a `CachedFont`.  Other attributes come from the wrapped `font`.
+
+    """
+    def __init__(self, font, advances, size, maxsize=4096):
+        super(ScaledFont, self).__init__(font, maxsize)
+        self.advances = advances
+        self.size = size
+
+    def width_of(self, text):
+        width = self.widths.get(text)
+        if width is None:
+            width = self.advances.width_of(text) * self.size
+            self.widths.set(text, width)
+        return width
@@ -0,0 +1,196 @@
+"""Choose the page breaks of a whole run of paragraphs at once.
+
+The actions in `composing` decide page breaks greedily, and patch the
+result by running content again when a widow, an orphan, or a
+stranded title turns up.  The `optimal_pages()` action instead breaks
+every paragraph that follows it into lines first, then chooses all of
+the page breaks together by dynamic programming, in the manner of
+Plass's optimal pagination: each page costs its unused space, each
+page break costs a penalty for the widow, orphan, or separated title
+it would create, and the breaks with the least total cost win.
+
+"""
+from collections import namedtuple
+
+from .composing import (
+    _galley_function, avoid_widows_and_orphans, section_break, section_title,
+)
+
+# A line waiting to be placed: its leading, height, and graphics; the
+# penalty for a page break after it; and, for the blank line of a
+# section break, the graphic it shows at the top or bottom of a page.
+PageLine = namedtuple('PageLine', 'leading height graphics penalty graphic')
+
+def optimal_pages(actions, a, fonts, line, next_line,
+                  widow_penalty=150, orphan_penalty=150,
+                  keep_penalty=10000, slack_demerit=100):
+    """Action: place the following actions, choosing page breaks together.
+
+    Takes over each following action that can produce a galley, like
+    `knuth_paragraph()`, along with `section_title()`,
+    `avoid_widows_and_orphans()`, and `section_break()` when what they
+    modify can be taken too -- a title must be followed by an action
+    that produces a galley -- and stopping at the first other action.
+    A page break costs `widow_penalty` before the
+    last line of a paragraph, `orphan_penalty` after its first line
+    (for paragraphs preceded by `avoid_widows_and_orphans()`), and
+    `keep_penalty` within or right after a title.  A page costs
+    `slack_demerit` times the square of the fraction of its height that
+    it leaves empty, except for the last page.  To change these, supply
+    the action as ``functools.partial(optimal_pages, widow_penalty=...)``.
+
+    This assumes that every column after the first has the same height
+    and width.
+
+    """
+    a2, page_lines = collect_page_lines(
+        actions, a + 1, fonts, line, next_line,
+        widow_penalty, orphan_penalty, keep_penalty)
+    if not page_lines:
+        return a2, line
+    breaks = choose_page_breaks(page_lines, line, next_line, slack_demerit)
+    return a2, place_page_lines(page_lines, breaks, line, next_line)
+
+def collect_page_lines(actions, a, fonts, line, next_line,
+                       widow_penalty, orphan_penalty, keep_penalty):
+    """Break actions from `a` into a list of `PageLine` tuples.
+
+    Returns the index of the first action not taken, and the list.
+
+    """
+    page_lines = []
+    keep = guard = False
+    while a < len(actions):
+        action, *args = actions[a]
+        if action in _modifiers:
+            # Take an action that modifies the ones after it only if
+            # they can be taken too, leaving it to run as usual if not.
+            end = _galley_end(actions, a + 1)
+            if end is None or (action is section_title
+                               and _galley_end(actions, end) is None):
+                break
+        if action is section_title:
+            keep = True
+            a += 1
+            continue
+        if action is avoid_widows_and_orphans:
+            guard = True
+            a += 1
+            continue
+        if action is section_break:
+            font_name, graphic = args
+            font = fonts[font_name]
+            if page_lines or line is not None:
+                page_lines.append(PageLine(font.leading, font.height, [],
+                                           0, graphic))
+            a += 1
+            continue
+        galley_function = _galley_function(action)
+        if galley_function is None:
+            break
+        a, galley = galley_function(actions, a, fonts, line, next_line,
+                                    *args)
+        n = len(galley.lines)
+        for i, graphics in enumerate(galley.lines):
+            penalty = 0
+            if keep:
+                penalty = keep_penalty
+            elif guard:
+                if i == 0 and n > 1:
+                    penalty += orphan_penalty
+                if i == n - 2:
+                    penalty += widow_penalty
+            page_lines.append(PageLine(galley.leading, galley.height,
+                                       graphics, penalty, None))
+        keep = guard = False
+    return a, page_lines
+
+# The actions that `collect_page_lines()` takes as modifying the
+# actions that follow them.
+_modifiers = section_title, avoid_widows_and_orphans, section_break
+
+def _galley_end(actions, a):
+    """Return the index after the next action from `a` to produce a galley.
+
+    Any modifiers before it are skipped.  Returns None if the next
+    other action cannot produce a galley, or if there is none.
+
+    """
+    while a < len(actions) and actions[a][0] in _modifiers:
+        a += 1
+    if a < len(actions) and _galley_function(actions[a][0]) is not None:
+        return a + 1
+    return None
+
+def choose_page_breaks(page_lines, line, next_line, slack_demerit):
+    """Return the set of indexes of the page lines that start new pages.
+
+    The first page continues the column of `line`, unless it is None.
+
+    """
+    n = len(page_lines)
+    infinity = float('inf')
+    costs = [infinity] * (n + 1)
+    starts = [-1] * (n + 1)
+
+    def slack_cost(y, column_height):
+        return slack_demerit * ((column_height - y) / column_height) ** 2
+
+    def end_page(j, k, y, column_height, cost):
+        # Consider ending at line k the page that began at line j.
+        if k < n:
+            cost += slack_cost(y, column_height)
+            if k:
+                cost += page_lines[k - 1].penalty
+        if cost < costs[k]:
+            costs[k] = cost
+            starts[k] = j
+
+    if line is None:
+        costs[0] = 0
+    else:
+        # The lines that can still fit in the column of `line`; the
+        # page may also end at once, sending every line on.
+        column_height = line.column.height
+        y = line.y
+        end_page(-1, 0, y, column_height, 0)
+        for k, page_line in enumerate(page_lines):
+            y += page_line.leading + page_line.height
+            if y > column_height:
+                break
+            end_page(-1, k + 1, y, column_height, 0)
+
+    height = next_line(line, 9999999, 0).column.height
+    for j in range(n):
+        if costs[j] == infinity:
+            continue
+        y = page_lines[j].height
+        end_page(j, j + 1, y, height, costs[j])
+        for k in range(j + 1, n):
+            page_line = page_lines[k]
+            y += page_line.leading + page_line.height
+            if y > height:
+                break
+            end_page(j, k + 1, y, height, costs[j])
+
+    breaks = set()
+    k = starts[n]
+    while k >= 0:
+        breaks.add(k)
+        k = starts[k]
+    return breaks
+
+def place_page_lines(page_lines, breaks, line, next_line):
+    """Place `page_lines` after `line`, starting a page at each break."""
+    previous_column = None if line is None else line.column
+    for k, page_line in enumerate(page_lines):
+        leading = 9999999 if k in breaks else page_line.leading
+        line = next_line(line, leading, page_line.height)
+        line.graphics.extend(page_line.graphics)
+        if page_line.graphic is not None:
+            at_top = line.column is not previous_column
+            at_bottom = k + 1 in breaks
+            if at_top or at_bottom:
+                line.graphics.append(page_line.graphic)
+        previous_column = line.column
+    return line
@@ -0,0 +1,213 @@
+"""Find out which actions a composition spends its time in.
+
+Pass a `Profiler` to `compose()` and it is told about every action run,
+including the speculative runs that `section_break()`,
+`section_title()`, and `avoid_widows_and_orphans()` make of the actions
+that follow them.  When one of those places the galley of an action
+like `knuth_paragraph()` again, rather than running it again, the
+placement is reported as a rerun of the action::
+
+    profiler = Profiler()
+    compose(actions, fonts, None, next_line, profiler=profiler)
+    print(profiler.report())
+
+A `Tracer` also records each action run, and each paragraph broken
+into lines, as a span that can be saved as a trace-event file and
+opened in a trace viewer like ``chrome://tracing`` or Perfetto::
+
+    tracer = Tracer()
+    compose(actions, fonts, None, next_line, profiler=tracer)
+    tracer.save('trace.json')
+
+When no profiler is given, `call_action()` checks a single global and
+does nothing more.
+
+"""
+import json
+import os
+import time
+from functools import partial
+
+from .vendored.texlib_wrap import BreakStats
+
+class ActionStats(object):
+    """What a `Profiler` learned about one kind of action.
+
+    `calls` counts every run; `nested` counts the runs made by other
+    actions, and `reruns` the runs of an action that had already been
+    run once before.  `seconds` is the wall time spent in the action
+    including the actions it ran, and `self_seconds` excluding them.
+    `lines` counts the lines produced, including those of the actions
+    it ran.
+
+    """
+    __slots__ = ('name', 'calls', 'nested', 'reruns', 'seconds',
+                 'self_seconds', 'lines')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.nested = 0
+        self.reruns = 0
+        self.seconds = 0.0
+        self.self_seconds = 0.0
+        self.lines = 0
+
+class Profiler(object):
+    """Count, time, and report the actions run by `compose()`."""
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.actions = {}
+        self.breaking = BreakStats()
+        self.paragraphs = []
+        self._ran = set()
+        self._stack = []
+
+    def begin_action(self, action, actions, a):
+        """Note the start of a run of `action`, returning a token for it."""
+        name = action_name(action)
+        stats = self.actions.get(name)
+        if stats is None:
+            stats = self.actions[name] = ActionStats(name)
+        stats.calls += 1
+        if self._stack:
+            stats.nested += 1
+        key = id(actions), a
+        rerun = key in self._ran
+        if rerun:
+            stats.reruns += 1
+        else:
+            self._ran.add(key)
+        # Each frame: the stats, the start time, the time spent in the
+        # actions it runs, the action index, and whether it is a rerun.
+        frame = [stats, self.clock(), 0.0, a, rerun]
+        self._stack.append(frame)
+        return frame
+
+    def end_action(self, frame, lines):
+        """Note the end of the action run that returned `frame`.
+
+        Returns the seconds that the run took.
+
+        """
+        stats, start, inner_seconds, a, rerun = frame
+        seconds = self.clock() - start
+        self._stack.pop()
+        # Time inside a run of the same action is already counted.
+        if not any(outer[0] is stats for outer in self._stack):
+            stats.seconds += seconds
+        stats.self_seconds += seconds - inner_seconds
+        stats.lines += lines
+        if self._stack:
+            self._stack[-1][2] += seconds
+        return seconds
+
+    def add_break_stats(self, fonts_and_texts, stats):
+        """Note the `BreakStats` of breaking a paragraph into lines.
+
+        They are added to the document's total in `breaking`, and kept
+        along with the paragraph's text in the list `paragraphs`.
+
+        """
+        self.breaking.add(stats)
+        text = ''.join(text for font_name, text in fonts_and_texts)
+        self.paragraphs.append((text, stats))
+
+    def begin_span(self, name, **args):
+        """Note the start of some other work, like breaking a paragraph."""
+
+    def end_span(self, span, **args):
+        """Note the end of the work whose `begin_span()` returned `span`."""
+
+    def report(self, sort='seconds', paragraphs=5):
+        """Return a table of the actions, most expensive first.
+
+        The rows are sorted on the `ActionStats` attribute `sort`.  If
+        any paragraphs were broken into lines, the table is followed by
+        their totals and by the `paragraphs` that considered the most
+        active nodes.
+
+        """
+        rows = sorted(self.actions.values(),
+                      key=lambda stats: getattr(stats, sort), reverse=True)
+        lines = ['{:<28} {:>7} {:>7} {:>7} {:>8} {:>10} {:>10}'.format(
+            'action', 'calls', 'nested', 'reruns', 'lines', 'seconds',
+            'self')]
+        for stats in rows:
+            lines.append(
+                '{:<28} {:>7} {:>7} {:>7} {:>8} {:>10.4f} {:>10.4f}'.format(
+                    stats.name, stats.calls, stats.nested, stats.reruns,
+                    stats.lines, stats.seconds, stats.self_seconds))
+        if self.paragraphs:
+            b = self.breaking
+            lines.append('')
+            lines.append(
+                '{} paragraphs: {} items, {} feasible breaks, {:.1f} average'
+                ' and {} peak active nodes, {} deactivated, {} attempts,'
+                ' {} failed'.format(
+                    len(self.paragraphs), b.items, b.feasible,
+                    b.active_average, b.active_peak, b.deactivated,
+                    b.attempts, b.failed))
+            if b.pruned:
+                lines.append('{} active nodes pruned, trailing the best'
+                             ' kept by at least {:.0f} demerits'.format(
+                                 b.pruned, b.margin))
+            if b.uncapped:
+                lines.append('{} tolerances tried again without the cap'
+                             ' after failing with it'.format(b.uncapped))
+            worst = sorted(self.paragraphs, reverse=True,
+                           key=lambda pair: pair[1].active_total)
+            for text, stats in worst[:paragraphs]:
+                lines.append('{:>10} active, {:>4} peak, {} attempts{}: {!r}'
+                             .format(stats.active_total, stats.active_peak,
+                                     stats.attempts,
+                                     ', FAILED' if stats.failed else '',
+                                     text[:40]))
+        return '\n'.join(lines)
+
+def action_name(action):
+    """Return the name under which `action` is reported."""
+    while isinstance(action, partial):
+        action = action.func
+    return getattr(action, '__name__', repr(action))
+
+class Tracer(Profiler):
+    """A `Profiler` that also records a span for each run and each piece
+    of work it is told about, as Chrome trace events."""
+
+    def __init__(self, clock=time.perf_counter):
+        super().__init__(clock)
+        self.origin = clock()
+        self.events = []
+
+    def end_action(self, frame, lines):
+        seconds = super().end_action(frame, lines)
+        stats, start, inner_seconds, a, rerun = frame
+        self._add_event(stats.name, 'action', start, seconds,
+                        {'a': a, 'rerun': rerun, 'lines': lines})
+        return seconds
+
+    def begin_span(self, name, **args):
+        return name, self.clock(), args
+
+    def end_span(self, span, **args):
+        name, start, begin_args = span
+        args = dict(begin_args, **args)
+        self._add_event(name, 'work', start, self.clock() - start, args)
+
+    def _add_event(self, name, category, start, seconds, args):
+        self.events.append({
+            'name': name, 'cat': category, 'ph': 'X',
+            'ts': (start - self.origin) * 1e6, 'dur': seconds * 1e6,
+            'pid': os.getpid(), 'tid': 0, 'args': args,
+        })
+
+    def trace(self):
+        """Return the events as a trace-event JSON object."""
+        return {'traceEvents': self.events, 'displayTimeUnit': 'ms'}
+
+    def save(self, path):
+        """Write the events to a trace-event JSON file at `path`."""
+        with open(path, 'w') as f:
+            json.dump(self.trace(), f)
@@ -6,7 +6,42 @@ Font = namedtuple('Font', 'ascent descent height leading')
 
 Page = namedtuple('Page', 'width height')
 Column = namedtuple('Column', 'page id x y width height')
-Line = namedtuple('Line', 'previous column y graphics')
+
+class Line(namedtuple('Line', 'previous column y graphics number jump')):
+    """A line of the layout, linked to the `previous` line.
+
+    Only the first four fields are given when making a line.  Its
+    `number` is then one more than the number of the previous line, or
+    1 if there is none, and `jump` links to an earlier line, chosen as
+    in a skew-binary random access list so that `ancestor()` can reach
+    any earlier line in a logarithmic number of steps.
+
+    """
+    __slots__ = ()
+
+    def __new__(cls, previous, column, y, graphics, number=None, jump=None):
+        if number is None:
+            if previous is None:
+                number = 1
+            else:
+                number = previous.number + 1
+                jump = previous
+                jump2 = previous.jump
+                if jump2 is not None and jump2.jump is not None and (
+                        previous.number - jump2.number
+                        == jump2.number - jump2.jump.number):
+                    jump = jump2.jump
+        return super().__new__(cls, previous, column, y, graphics,
+                               number, jump)
+
+    def __repr__(self):
+        return 'Line(previous={!r}, column={!r}, y={!r}, graphics={!r})' \
+            .format(self.previous, self.column, self.y, self.graphics)
+
+# Lines that are already broken and justified but not yet placed: a
+# list of graphics lists, one per line, all with the same leading and
+# height, that were set for a column of the given width.
+Galley = namedtuple('Galley', 'width leading height lines')
 
 def single_column_layout(width, height, top, bottom, inner, outer):
     column_width = width - inner - outer
@@ -34,8 +69,47 @@ def single_column_layout(width, height, top, bottom, inner, outer):
             column = None
         return Line(line, next_column(column), height, [])
 
+    def place(column, y, leading, height):
+        # Where next_line() would put a line after one at `y` in
+        # `column`, for callers like a LineStore that make no Line.
+        if column is not None:
+            y2 = y + height + leading
+            if y2 <= column.height:
+                return column, y2
+        return next_column(column), height
+
+    next_line.place = place
     return next_line
 
+def line_number(line):
+    """Return the `number` of `line`, counting None as line 0."""
+    return 0 if line is None else line.number
+
+def ancestor(line, number):
+    """Return the line numbered `number` among `line` and those before it."""
+    while line is not None and line.number > number:
+        jump = line.jump
+        if jump is not None and jump.number >= number:
+            line = jump
+        else:
+            line = line.previous
+    return line
+
+def count_lines(start_line, end_line):
+    """Return how many lines follow `start_line`, through `end_line`."""
+    return line_number(end_line) - line_number(start_line)
+
+def nth_line(start_line, end_line, n):
+    """Return ``unroll(start_line, end_line)[n]``, without the list.
+
+    As with a list, a negative `n` counts back from `end_line`.
+
+    """
+    number = line_number(start_line)
+    if n < 0:
+        n += line_number(end_line) - number + 1
+    return ancestor(end_line, number + n)
+
 def unroll(start_line, end_line):
     lines = [end_line]
     while end_line is not start_line:
@@ -43,3 +117,12 @@ def unroll(start_line, end_line):
         lines.append(end_line)
     lines.reverse()
     return lines
+
+def place_galley(galley, line, next_line):
+    """Place the lines of `galley` after `line`, returning the last one."""
+    leading = galley.leading
+    height = galley.height
+    for graphics in galley.lines:
+        line = next_line(line, leading, height)
+        line.graphics.extend(graphics)
+    return line
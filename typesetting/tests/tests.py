@@ -1,10 +1,38 @@
+import itertools
+import json
+import math
+import os
+import pickle
+import random
+import subprocess
+import sys
+from functools import partial
 
 from typesetting.composing import (
-    avoid_widows_and_orphans, run, section_break, section_title,
+    avoid_widows_and_orphans, centered_paragraph, compose_pages,
+    compose_parallel, new_page, new_recto_page, run, section_break,
+    section_title, vskip,
 )
+from typesetting.cache import LRUCache
+from typesetting.incremental import compose_with_checkpoints, recompose
+from typesetting.knuth import (
+    _build_object_list, knuth_paragraph, paragraph_cache,
+)
+from typesetting.linestore import LineStore
+from typesetting.pagination import optimal_pages
+from typesetting.profiling import Profiler, Tracer
+from typesetting.metrics import AdvanceTable, CachedFont, ScaledFont
+from typesetting.ttf import TTFMetrics, load_fonts
+from typesetting.vocabulary import build_vocabulary, with_vocabulary
 from typesetting.skeleton import (
-    Column, Font, Line, Page, single_column_layout, unroll,
+    Column, Font, Galley, Line, Page, ancestor, count_lines, nth_line,
+    place_galley, single_column_layout, unroll,
+)
+from typesetting.vendored.texlib_wrap import (
+    Box, BreakStats, Glue, ObjectList, PackedObjectList, Penalty,
+    _ActiveNodes, _BreakNode,
 )
+from typesetting.vendored.hyphenate import Hyphenator
 
 next_line = single_column_layout(10, 34, 0, 0, 0, 0)
 
@@ -30,6 +58,19 @@ def test_line_positions():
     assert l3 == Line(l2, c1, 34, [])
     assert l4 == Line(l3, c2, 10, [])
 
+
+def test_line_numbers_give_quick_access_to_earlier_lines():
+    lines = [None]
+    for i in range(100):
+        lines.append(next_line(lines[-1], 2, 10))
+    assert [line.number for line in lines[1:]] == list(range(1, 101))
+    assert ancestor(lines[100], 37) is lines[37]
+    assert ancestor(lines[100], 0) is None
+    start, end = lines[40], lines[90]
+    assert count_lines(start, end) == 50
+    for n in 0, 1, 2, 25, -2, -1:
+        assert nth_line(start, end, n) is unroll(start, end)[n]
+
 def test_nice_paragraph():
     # It produces neither an orphan nor a widow.
     l1 = next_line(None, 2, 10)
@@ -223,6 +264,30 @@ def test_widow_that_cannot_be_fixed():
     assert l3 == Line(l2, c1, 34, [])
     assert l4 == Line(l3, c2, 10, [])
 
+def test_widow_fix_places_galley_without_breaking_it_again():
+    calls = []
+
+    def galley_paragraph(actions, a, fonts, line, next_line, n):
+        calls.append(n)
+        return a + 1, Galley(10, 2, 10, [['p']] * n)
+
+    def paragraph(actions, a, fonts, line, next_line, n):
+        a2, galley = galley_paragraph(actions, a, fonts, line, next_line, n)
+        return a2, place_galley(galley, line, next_line)
+
+    paragraph.galley = galley_paragraph
+
+    assert _run(
+        (avoid_widows_and_orphans,),
+        (paragraph, 4),
+    ) == [
+        (1, 10, ['p']),
+        (1, 22, ['p']),
+        (2, 10, ['p']),
+        (2, 22, ['p']),
+    ]
+    assert calls == [4]
+
 def test_section_break_that_creates_blank_line():
     assert _run(
         (make_paragraph, 2, 10, 1, 'p1'),
@@ -293,6 +358,344 @@ def test_section_break_with_graphic_on_bottom_but_content_wants_to_stay():
         (2, 10, ['p2']),
     ]
 
+def test_memo_copies_lines_when_a_rerun_starts_from_the_same_place():
+    actions = [
+        (make_paragraph, 2, 10, 1, 'p1'),
+        (section_break, 'body', '* * *'),
+        (section_title,),
+        (make_paragraph, 3, 10, 1, 'title'),
+        (make_paragraph, 2, 10, 1, 'p2'),
+    ]
+    expected = [
+        (1, 10, ['p1']),
+        (1, 22, []),
+        (1, 34, ['* * *']),
+        (2, 10, ['title']),
+        (2, 22, ['p2']),
+    ]
+    assert _run(*actions) == expected
+
+    # The section break first tries the title after the blank line,
+    # where it lands atop the next column, then tries it again after
+    # the graphic; the paragraph after the title is not run again.
+    memo = LRUCache()
+    line = run(actions, _fonts, None, next_line, memo=memo)
+    lines = unroll(None, line)[1:]
+    assert [(l.column.id, l.y, l.graphics) for l in lines] == expected
+    assert lines[3].column is lines[4].column
+    assert memo.hits == 1
+
+def test_memo_saves_runs_in_a_document_of_titled_sections():
+    def document():
+        actions = []
+        for i in range(6):
+            if i:
+                actions.append((section_break, 'body', 'graphic'))
+            actions.append((section_title,))
+            actions.append((centered_paragraph, [('mono', 'Section %d' % i)]))
+            for j in range(3):
+                text = '%d %d %s' % (i, j, _easy_text * (1 + j))
+                actions.append((avoid_widows_and_orphans,))
+                actions.append((knuth_paragraph, 0, 0, [('mono', text)]))
+        return actions
+
+    # Across page heights, titles pushed to the next page by the
+    # section break before them are run again from the same place.
+    hits = 0
+    for height in range(100, 200, 3):
+        next_line = single_column_layout(200, height, 0, 0, 0, 0)
+        actions = document()
+        expected = unroll(None, run(actions, _fonts, None, next_line))[1:]
+        memo = LRUCache()
+        line = run(actions, _fonts, None, next_line, memo=memo)
+        lines = unroll(None, line)[1:]
+        assert ([(l.column.id, l.y, l.graphics) for l in lines] ==
+                [(l.column.id, l.y, l.graphics) for l in expected])
+        hits += memo.hits
+    assert hits >= 30
+
+def test_memo_is_not_shared_between_compositions():
+    next_line = single_column_layout(200, 200, 0, 0, 0, 0)
+    memo = LRUCache()
+    for text in 'alpha beta gamma', 'totally different words here':
+        actions = [(knuth_paragraph, 0, 0, [('mono', text)])]
+        line = run(actions, _fonts, None, next_line, memo=memo)
+        (function, xlist), = line.graphics
+        words = ''.join(text for x, font_name, text in xlist)
+        assert words == text.replace(' ', '')
+
+def test_profiler_counts_reruns_and_lines():
+    actions = [
+        (make_paragraph, 2, 10, 1, 'p1'),
+        (section_break, 'body', '* * *'),
+        (section_title,),
+        (make_paragraph, 3, 10, 1, 'title'),
+        (make_paragraph, 2, 10, 1, 'p2'),
+    ]
+    # A clock that ticks once per reading.
+    profiler = Profiler(clock=itertools.count().__next__)
+    run(actions, _fonts, None, next_line, profiler=profiler)
+    stats = profiler.actions
+    assert set(stats) == {'make_paragraph', 'section_break', 'section_title'}
+    assert stats['section_break'].calls == 1
+    assert stats['section_break'].nested == 0
+    assert stats['section_break'].lines == 4
+    assert stats['section_title'].calls == 2
+    assert stats['section_title'].reruns == 1
+    assert stats['section_title'].nested == 2
+    assert stats['make_paragraph'].calls == 5
+    assert stats['make_paragraph'].reruns == 2
+    # The 16 clock readings at the start and end of the 8 runs span 15
+    # ticks, all but one of them (between the top-level actions) spent
+    # in some action.
+    assert sum(s.self_seconds for s in stats.values()) == 14
+    assert stats['section_break'].seconds == 13
+    assert 'section_title' in profiler.report()
+
+def test_profiler_counts_galleys_placed_again():
+    paragraph_cache.clear()
+    actions = [
+        (make_paragraph, 2, 10, 15),
+        (avoid_widows_and_orphans,),
+        (knuth_paragraph, 0, 0, [('mono', _easy_text)]),
+    ]
+    next_line = single_column_layout(200, 200, 0, 0, 0, 0)
+    profiler = Profiler()
+    run(actions, _fonts, None, next_line, profiler=profiler)
+    # The paragraph is broken once and placed twice, to avoid leaving
+    # its first line at the bottom of the column.
+    stats = profiler.actions['knuth_paragraph']
+    assert (stats.calls, stats.nested, stats.reruns, stats.lines) == (
+        2, 2, 1, 6)
+    assert len(profiler.paragraphs) == 1
+    assert profiler.actions['avoid_widows_and_orphans'].lines == 3
+
+def test_draft_places_what_follows_only_once():
+    actions = [
+        (make_paragraph, 2, 10, 2, 'p1'),
+        (section_break, 'body', '* * *'),
+        (section_title,),
+        (make_paragraph, 2, 10, 1, 'title'),
+        (avoid_widows_and_orphans,),
+        (make_paragraph, 2, 10, 3, 'p2'),
+    ]
+    profiler = Profiler()
+    line = run(actions, _fonts, None, next_line, profiler=profiler,
+               draft=True)
+    lines = unroll(None, line)[1:]
+    assert [(l.column.id, l.y, l.graphics) for l in lines] == [
+        (1, 10, ['p1']),
+        (1, 22, ['p1']),
+        (1, 34, ['* * *']),
+        (2, 10, ['title']),
+        (2, 22, ['p2']),
+        (2, 34, ['p2']),
+        (3, 10, ['p2']),
+    ]
+    assert all(s.reruns == 0 for s in profiler.actions.values())
+
+def test_recompose_resumes_at_the_edit_and_resyncs():
+    actions = [(make_paragraph, 2, 10, 2, 'p%d' % i) for i in range(6)]
+    composition = compose_with_checkpoints(actions, _fonts, None, next_line)
+    old_lines = unroll(None, composition.end_line)[1:]
+    assert _run(*actions) == [(l.column.id, l.y, l.graphics)
+                              for l in old_lines]
+
+    # The same number of lines: only the edited column changes.
+    actions[2] = (make_paragraph, 2, 10, 2, 'P2')
+    composition, changed = recompose(composition, actions, _fonts, next_line)
+    assert changed == (2, 2)
+    lines = unroll(None, composition.end_line)[1:]
+    assert _run(*actions) == [(l.column.id, l.y, l.graphics) for l in lines]
+    assert lines[2] is old_lines[2]
+    assert [c.a for c in composition.checkpoints] == list(range(6))
+
+    # An extra line shifts every column that follows.
+    actions[2] = (make_paragraph, 2, 10, 3, 'P2')
+    composition, changed = recompose(composition, actions, _fonts, next_line)
+    assert changed == (2, 5)
+    lines = unroll(None, composition.end_line)[1:]
+    assert _run(*actions) == [(l.column.id, l.y, l.graphics) for l in lines]
+
+    assert recompose(composition, actions, _fonts, next_line)[1] is None
+
+def test_recompose_restarts_before_actions_that_looked_ahead():
+    actions = [
+        (make_paragraph, 2, 10, 2, 'p1'),
+        (section_break, 'body', '* * *'),
+        (make_paragraph, 2, 10, 1, 'p2'),
+    ]
+    composition = compose_with_checkpoints(actions, _fonts, None, next_line)
+    assert [(c.a, c.reach) for c in composition.checkpoints] == [
+        (0, 0), (1, 2), (2, 2)]
+    actions[2] = (make_paragraph, 2, 10, 1, 'P2')
+    composition, changed = recompose(composition, actions, _fonts, next_line)
+    lines = unroll(None, composition.end_line)[1:]
+    assert _run(*actions) == [(l.column.id, l.y, l.graphics) for l in lines]
+    assert changed == (2, 2)
+
+def test_recompose_reruns_a_last_action_when_actions_are_appended():
+    actions = [
+        (make_paragraph, 2, 10, 1, 'p1'),
+        (section_break, 'body', '* * *'),
+    ]
+    composition = compose_with_checkpoints(actions, _fonts, None, next_line)
+    assert composition.checkpoints[1].reach == 2
+    actions.append((make_paragraph, 2, 10, 1, 'p2'))
+    composition, changed = recompose(composition, actions, _fonts, next_line)
+    lines = unroll(None, composition.end_line)[1:]
+    assert _run(*actions) == [(l.column.id, l.y, l.graphics) for l in lines]
+    assert [(l.column.id, l.y) for l in lines] == [(1, 10), (1, 22), (1, 34)]
+
+def test_line_store_holds_lines_in_arrays():
+    actions = [
+        (make_paragraph, 2, 10, 1, 'p1'),
+        (section_break, 'body', '* * *'),
+        (make_paragraph, 3, 10, 1, 'p2'),
+        (avoid_widows_and_orphans,),
+        (make_paragraph, 2, 10, 4, 'p3'),
+    ]
+    store = LineStore()
+    end_line = run(actions, _fonts, None, store.layout(next_line))
+    assert end_line.number == 8
+    # Only the views still held are kept, and the columns of the
+    # attempts that were thrown away are shared.
+    assert list(store._views.values()) == [end_line]
+    assert [column.id for column in store.columns] == [1, 2, 3]
+    lines = store.compact(end_line)
+    assert len(store) > len(lines) == 8
+    assert [(l.column.id, l.y, l.graphics) for l in lines.lines()] == (
+        _run(*actions))
+    assert [lines.page_number(l) for l in lines.lines()] == [
+        0, 0, 0, 1, 1, 1, 2, 2]
+    assert lines.pages == [Page(10, 34)]
+
+    # A next_line that cannot say where it will put a line is called.
+    store = LineStore()
+    layout = store.layout(lambda *args: next_line(*args))
+    end_line = run(actions, _fonts, None, layout)
+    lines = store.compact(end_line)
+    assert [(l.column.id, l.y, l.graphics) for l in lines.lines()] == (
+        _run(*actions))
+
+def test_compose_pages_generates_finished_pages():
+    actions = [(make_paragraph, 2, 10, 1, 'p%d' % i) for i in range(7)]
+    actions.insert(3, (make_paragraph, 2, 10, 4, 'long'))
+    expected = _run(*actions)
+    pages = list(compose_pages(actions, _fonts, None, next_line))
+    assert [page for page, lines in pages] == [Page(10, 34)] * 4
+    assert [(l.column.id, l.y, l.graphics)
+            for page, lines in pages for l in lines] == expected
+    for page, lines in pages:
+        assert all(line.column.page is page for line in lines)
+
+    # Each batch of pages that an action finishes is cut loose from
+    # the pages before it; the long paragraph finished pages 1 and 2.
+    assert [lines[0].previous is None for page, lines in pages] == [
+        True, False, True, True]
+
+def test_compose_parallel_matches_compose():
+    layout = partial(single_column_layout, 40, 34, 0, 0, 5, 0)
+    actions = [
+        (make_paragraph, 2, 10, 2, 'a'),
+        (new_recto_page,),
+        (make_paragraph, 2, 10, 4, 'b'),
+        (new_page,),
+        (make_paragraph, 2, 10, 1, 'c'),
+        (section_break, 'body', '* * *'),
+        (make_paragraph, 2, 10, 1, 'd'),
+        (new_recto_page,),
+        (make_paragraph, 2, 10, 1, 'e'),
+    ]
+    expected = unroll(None, run(actions, _fonts, None, layout()))
+    line = compose_parallel(actions, _fonts, None, layout, processes=2)
+    lines = unroll(None, line)
+    assert lines == expected
+    assert [l.column.id for l in lines[1:]] == [1, 1, 2, 3, 3, 3, 4, 5, 5, 5,
+                                              6, 7]
+    assert lines[5].column is lines[4].column
+
+    # A vskip() runs the new_recto_page() after it, which starts the
+    # next piece; that piece must then be composed as compose() would.
+    for n in 1, 4, 5, 6:
+        actions = [
+            (make_paragraph, 2, 10, 1, 'a'),
+            (new_page,),
+            (make_paragraph, 2, 10, n, 'b'),
+            (vskip, 1),
+            (new_recto_page,),
+            (make_paragraph, 2, 10, 1, 'c'),
+        ]
+        expected = unroll(None, run(actions, _fonts, None, layout()))
+        line = compose_parallel(actions, _fonts, None, layout, processes=2)
+        assert unroll(None, line) == expected
+
+def galley_paragraph(actions, a, fonts, line, next_line, n, graphic):
+    a2, galley = galley_paragraph.galley(actions, a, fonts, line, next_line,
+                                         n, graphic)
+    return a2, place_galley(galley, line, next_line)
+
+def _galley_of_paragraph(actions, a, fonts, line, next_line, n, graphic):
+    return a + 1, Galley(10, 2, 10, [[graphic]] * n)
+
+galley_paragraph.galley = _galley_of_paragraph
+
+def test_optimal_pages_avoids_an_orphan_and_a_widow_at_once():
+    actions = [
+        (galley_paragraph, 2, 'p1'),
+        (avoid_widows_and_orphans,),
+        (galley_paragraph, 4, 'p2'),
+    ]
+    expected = [
+        (1, 10, ['p1']),
+        (1, 22, ['p1']),
+        (2, 10, ['p2']),
+        (2, 22, ['p2']),
+        (3, 10, ['p2']),
+        (3, 22, ['p2']),
+    ]
+    assert _run(*actions) == expected
+    assert _run((optimal_pages,), *actions) == expected
+
+def test_optimal_pages_keeps_a_title_with_what_follows():
+    actions = [
+        (optimal_pages,),
+        (galley_paragraph, 2, 'p1'),
+        (section_title,),
+        (galley_paragraph, 1, 'title'),
+        (galley_paragraph, 3, 'p2'),
+        (make_paragraph, 2, 10, 1, 'after'),
+    ]
+    assert _run(*actions) == [
+        (1, 10, ['p1']),
+        (1, 22, ['p1']),
+        (2, 10, ['title']),
+        (2, 22, ['p2']),
+        (2, 34, ['p2']),
+        (3, 10, ['p2']),
+        (3, 22, ['after']),
+    ]
+
+def test_optimal_pages_leaves_a_title_it_cannot_take():
+    # The title has no galley, so the title and what follows are left
+    # to section_title(), which moves the title to the next column.
+    actions = [
+        (make_paragraph, 2, 10, 1, 'p0'),
+        (optimal_pages,),
+        (galley_paragraph, 1, 'p1'),
+        (section_title,),
+        (make_paragraph, 2, 10, 1, 'title'),
+        (make_paragraph, 2, 10, 2, 'body'),
+    ]
+    expected = _run(*actions[:1] + actions[2:])
+    assert expected[2:] == [(2, 10, ['title']), (2, 22, ['body']),
+                            (2, 34, ['body'])]
+    assert _run(*actions) == expected
+
+    # Nor does it take a title followed by an action without a galley.
+    actions[4] = (galley_paragraph, 1, 'title')
+    assert _run(*actions) == expected
+
 def test_title_without_anything_after_it():
     actions = [
         (section_title,),
@@ -333,9 +736,495 @@ def test_title_without_enough_room():
     assert l3 == Line(l2, c2, 10, [])
     assert l4 == Line(l3, c2, 22, [])
 
+def test_packed_object_list_breaks_like_object_list():
+    olist = ObjectList()
+    for word in 'the quick brown fox jumps over the lazy dog again'.split():
+        olist.append(Box(len(word), word))
+        olist.append(Penalty(1, 100))
+        olist.append(Box(1, '.'))
+        olist.append(Glue(2, 1, 1))
+    olist.pop()
+    olist.add_closing_penalty()
+
+    packed = PackedObjectList(olist)
+    assert len(packed) == len(olist)
+    breaks = olist.compute_breakpoints([20], tolerance=3)
+    assert packed.compute_breakpoints([20], tolerance=3) == breaks
+    assert len(breaks) > 2
+
+    start = 0
+    for line, breakpoint in enumerate(breaks[1:]):
+        r1 = olist.compute_adjustment_ratio(start, breakpoint, line, [20])
+        r2 = packed.compute_adjustment_ratio(start, breakpoint, line, [20])
+        assert r1 == r2
+        start = breakpoint + 1
+
+_easy_text = ('Paragraph breaking considers hyphenation everywhere, although'
+              ' typical paragraphs rarely require hyphenated words.')
+
+def test_knuth_paragraph():
+    texts = _knuth_run(200, (knuth_paragraph, 0, 0, [('mono', _easy_text)]))
+    assert texts[0][:3] == ['Para', 'graph', 'break']
+    assert len(texts) == 3
+
+def test_knuth_paragraph_pretolerance_skips_hyphenation():
+    action = partial(knuth_paragraph, pretolerance=1)
+    texts = _knuth_run(200, (action, 0, 0, [('mono', _easy_text)]))
+    assert texts == [
+        ['Paragraph', 'breaking', 'considers', 'hyphenation'],
+        ['everywhere,', 'although', 'typical', 'paragraphs'],
+        ['rarely', 'require', 'hyphenated', 'words.'],
+    ]
+
+def test_tracer_records_nested_spans(tmp_path):
+    paragraph_cache.clear()
+    action = partial(knuth_paragraph, pretolerance=1)
+    actions = [
+        (action, 0, 0, [('mono', _easy_text)]),
+        (section_break, 'body', '* * *'),
+        (avoid_widows_and_orphans,),
+        (action, 0, 0, [('mono', 'Another paragraph.')]),
+    ]
+    next_line = single_column_layout(200, 200, 0, 0, 0, 0)
+    tracer = Tracer()
+    run(actions, _fonts, None, next_line, profiler=tracer)
+    path = str(tmp_path / 'trace.json')
+    tracer.save(path)
+    with open(path) as f:
+        events = json.load(f)['traceEvents']
+    assert [(e['name'], e['args'].get('a')) for e in events] == [
+        ('compute_breakpoints', None),
+        ('knuth_paragraph', 0),
+        ('compute_breakpoints', None),
+        ('knuth_paragraph', 3),
+        ('avoid_widows_and_orphans', 2),
+        ('section_break', 1),
+    ]
+    breaking = events[0]
+    assert breaking['args']['tolerances'] == [1]
+    assert breaking['args']['tolerance'] == 1
+    # The paragraph wrapped by avoid_widows_and_orphans() has a span of
+    # its own, within that of the wrapper.
+    for inner, outer in (2, 3), (3, 4), (4, 5):
+        span, event = events[outer], events[inner]
+        assert span['ts'] <= event['ts']
+        assert event['ts'] + event['dur'] <= span['ts'] + span['dur']
+    assert events[3]['args']['lines'] == 1
+
+def test_profiler_collects_break_stats(capsys):
+    paragraph_cache.clear()
+    impossible = 'Supercalifragilisticexpialidocious ' + 'x' * 50
+    actions = [
+        (knuth_paragraph, 0, 0, [('mono', _easy_text)]),
+        (knuth_paragraph, 0, 0, [('mono', impossible)]),
+    ]
+    next_line = single_column_layout(200, 200, 0, 0, 0, 0)
+    profiler = Profiler()
+    run(actions, _fonts, None, next_line, profiler=profiler)
+    assert capsys.readouterr().out == 'FAIL\n'
+    (text1, stats1), (text2, stats2) = profiler.paragraphs
+    assert text1 == _easy_text
+    assert stats1.as_dict() == {
+        'calls': 1, 'items': 56, 'feasible': 27, 'active_total': 29,
+        'active_peak': 2, 'deactivated': 3, 'attempts': 1, 'failed': 0,
+        'pruned': 0, 'margin': None, 'uncapped': 0,
+    }
+    assert (stats2.failed, stats2.active_peak) == (1, 1)
+    total = profiler.breaking
+    assert total.feasible == stats1.feasible + stats2.feasible
+    assert total.active_average == (29 + stats2.active_total) / total.feasible
+    assert total.failed == 1
+    assert 'FAILED' in profiler.report()
+
+def test_first_fit_fills_each_line_in_turn():
+    olist = PackedObjectList()
+    for i in range(10):
+        olist.append_box(10, 'word')
+        olist.append_glue(5, 2.5, 1.7)
+    olist.pop()
+    olist.add_closing_penalty()
+    # Four words take 55 points, and five cannot shrink to 60.
+    breaks = olist.compute_breakpoints_first_fit([60])
+    assert breaks == [0, 7, 15, len(olist) - 1]
+
+def test_knuth_paragraph_draft_breaks_first_fit():
+    paragraph_cache.clear()
+    actions = [(knuth_paragraph, 0, 0, [('mono', _easy_text)])]
+    next_line = single_column_layout(200, 200, 0, 0, 0, 0)
+    line = run(actions, _fonts, None, next_line, draft=True)
+    texts = [''.join(text for x, font_name, text in xlist)
+             for line in unroll(None, line)[1:]
+             for function, xlist in line.graphics]
+    assert texts == [
+        'Paragraphbreakingconsidershyphenation',
+        'everywhere,althoughtypicalparagraphs',
+        'rarelyrequirehyphenatedwords.',
+    ]
+    # The draft breaks are cached apart from the optimal ones.
+    assert _knuth_run(200, *actions)[0][:3] == ['Para', 'graph', 'break']
+
+def test_max_active_caps_the_active_nodes_for_each_line():
+    olist = PackedObjectList()
+    for i in range(640):
+        olist.append_box(5 * (3 + i % 7), 'word')
+        olist.append_glue(5, 2.5, 1.7)
+    olist.pop()
+    olist.add_closing_penalty()
+
+    stats = BreakStats()
+    breaks, tolerance = olist.compute_breakpoints_escalating(
+        [200], stats=stats)
+    assert (stats.active_peak, stats.pruned, stats.margin) == (4, 0, None)
+
+    # A cap that is never reached changes nothing.
+    assert olist.compute_breakpoints_escalating(
+        [200], max_active=2) == (breaks, tolerance)
+
+    stats = BreakStats()
+    breaks1, tolerance1 = olist.compute_breakpoints_escalating(
+        [200], stats=stats, max_active=1)
+    assert stats.active_peak == 2
+    assert stats.active_total == 791
+    assert stats.pruned == 22
+    assert stats.margin > 0
+    assert breaks1[0] == 0 and breaks1[-1] == len(olist) - 1
+
+def test_max_active_never_raises_the_tolerance():
+    widths = [9, 11, 5, 9, 3, 2, 3, 6, 8, 7, 8, 6, 2, 9, 2, 3, 5, 8, 7,
+              7, 6, 3, 11, 2, 7, 6, 2, 10, 11, 2, 3, 2, 8, 9, 5, 5, 4, 3]
+    olist = PackedObjectList()
+    for i, width in enumerate(widths):
+        olist.append_box(5 * width, 'word')
+        olist.append_glue(5, 2.5 if i % 3 == 0 else 1, 1.7)
+    olist.pop()
+    olist.add_closing_penalty()
+
+    breaks, tolerance = olist.compute_breakpoints_escalating([200])
+    stats = BreakStats()
+    assert olist.compute_breakpoints_escalating(
+        [200], stats=stats, max_active=1) == (breaks, tolerance)
+    # The capped scan failed, so the same tolerance was scanned again
+    # without the cap, instead of going on to a looser one.
+    assert stats.uncapped == 1
+    assert stats.attempts == 2
+
+def test_knuth_paragraph_max_active():
+    paragraph_cache.clear()
+    text = ' '.join([_easy_text] * 4)
+    action = partial(knuth_paragraph, max_active=1)
+    profiler = Profiler()
+    next_line = single_column_layout(200, 200, 0, 0, 0, 0)
+    run([(action, 0, 0, [('mono', text)])], _fonts, None, next_line,
+        profiler=profiler)
+    assert profiler.breaking.pruned == 5
+    assert profiler.breaking.margin > 0
+    # The capped breaks are cached apart from the others.
+    texts = _knuth_run(200, (knuth_paragraph, 0, 0, [('mono', text)]))
+    assert texts[0][-1] == '-'
+
+def test_only_a_trailing_space_is_dropped():
+    space_glue = (5, 2.5, 1.6665)
+    for texts, widths in [
+            ([('mono', 'word ')], [5, 20]),
+            ([('mono', 'word '), ('mono', '')], [5, 20]),
+            # An indent as wide as a space is not a space.
+            ([('mono', '')], [5]),
+    ]:
+        olist = _build_object_list(_fonts, texts, 5, space_glue, None)
+        assert list(olist.width[:-3]) == widths
+
+def test_knuth_paragraph_cache():
+    paragraph_cache.clear()
+    action = (knuth_paragraph, 0, 0, [('mono', _easy_text)])
+    texts = _knuth_run(200, action)
+    assert (paragraph_cache.hits, paragraph_cache.misses) == (0, 1)
+    assert _knuth_run(200, action) == texts
+    assert (paragraph_cache.hits, paragraph_cache.misses) == (1, 1)
+    _knuth_run(250, action)
+    assert (paragraph_cache.hits, paragraph_cache.misses) == (1, 2)
+
+def test_vocabulary_measures_each_token_once():
+    font = CachedFont(_fonts['mono'])
+    fonts = {'mono': font}
+    next_line = single_column_layout(200, 200, 0, 0, 0, 0)
+    actions = [
+        (knuth_paragraph, 0, 0, [('mono', _easy_text)]),
+        (knuth_paragraph, 0, 10, [('mono', _easy_text)]),
+    ]
+    paragraph_cache.clear()
+    expected = unroll(None, run(actions, fonts, None, next_line))
+    actions = with_vocabulary(actions, fonts)
+    font.widths.clear()
+    paragraph_cache.clear()
+    lines = unroll(None, run(actions, fonts, None, next_line))
+    assert lines == expected
+    # Only the space and hyphen widths are asked for, once per paragraph.
+    assert font.widths.hits + font.widths.misses == 6
+
+def test_vocabulary_built_by_worker_processes():
+    actions = [(knuth_paragraph, 0, 0, [('mono', _easy_text)])]
+    serial = build_vocabulary(actions, _fonts)
+    parallel = build_vocabulary(actions, _fonts, processes=2, chunk_size=4)
+    assert len(parallel) == len(serial) == 12
+    assert parallel.hyphenated == serial.hyphenated
+    assert parallel.plain == serial.plain
+    assert serial.words_for('mono', _fonts['body'], None) is None
+
+def test_cached_font():
+    font = CachedFont(_fonts['mono'], maxsize=2)
+    assert font.height == 10
+    assert font.width_of('abc') == 15
+    assert font.width_of('abc') == 15
+    font.width_of('d')
+    font.width_of('e')
+    assert font.width_of('abc') == 15
+    assert (font.widths.hits, font.widths.misses) == (1, 4)
+
+def test_advance_table_kerns_and_scales():
+    measured = []
+
+    def measure(text):  # at size 10, with 'AV' kerned together by 3
+        measured.append(text)
+        return 10 * len(text) - 3 * text.count('AV')
+
+    table = AdvanceTable(measure, 10)
+    assert table.width_of('AVA') == 2.7
+    assert table.width_of('VAVA') == 3.7
+    assert sorted(measured) == ['A', 'AV', 'V', 'VA']
+
+    font = ScaledFont(_fonts['mono'], table, 20)
+    assert font.width_of('AV') == 34
+    assert font.leading == 2
+
+def test_ttf_metrics():
+    metrics = TTFMetrics(_font_path('OldStandard-Regular.ttf'), use_mmap=True)
+    font = metrics.font(10)
+    assert font.height == 10 * (metrics.ascent + metrics.descent)
+    assert font.width_of('AV') < font.width_of('A') + font.width_of('V')
+    assert metrics.font(20).width_of('AV') == 2 * font.width_of('AV')
+
+    font = pickle.loads(pickle.dumps(font))
+    assert font.width_of('AV') == metrics.font(10).width_of('AV')
+
+def test_ttf_fonts_lay_out_a_paragraph_without_qt():
+    fonts = load_fonts([('roman', _font_path('GenBasR.ttf'), 12)])
+    next_line = single_column_layout(300, 400, 0, 0, 0, 0)
+    line = run([
+        (knuth_paragraph, 0, 0, [('roman', _easy_text * 3)]),
+    ], fonts, None, next_line)
+    lines = unroll(None, line)[1:]
+    assert 3 < len(lines) < 10
+    for line in lines:
+        (function, xlist), = line.graphics
+        assert xlist[-1][0] < 300
+
+def _font_path(name):
+    return os.path.join(os.path.dirname(__file__), '..', '..', 'fonts', name)
+
+def test_escalating_tolerance_matches_starting_over():
+    for seed in range(40):
+        olist = _random_paragraph(seed)
+        expected = None
+        for tolerance in 1, 2, 3, 4, 5, 6, 7:
+            try:
+                breaks = olist.compute_breakpoints([40], tolerance=tolerance)
+            except RuntimeError:
+                continue
+            expected = breaks, tolerance
+            break
+        try:
+            result = olist.compute_breakpoints_escalating([40])
+        except RuntimeError:
+            result = None
+        assert result == expected
+
+def _random_paragraph(seed):
+    rand = random.Random(seed)
+    olist = PackedObjectList()
+    for i in range(rand.randint(5, 60)):
+        olist.append_box(rand.randint(1, 14))
+        if rand.random() < .3:
+            olist.append_penalty(1, 100, 1)
+            olist.append_box(rand.randint(1, 8))
+        olist.append_glue(2, rand.choice([.5, 1, 2]), .5)
+    olist.pop()
+    olist.add_closing_penalty()
+    return olist
+
+def test_active_nodes_are_sorted_unique_and_deactivatable():
+    def node(position, line, fitness_class=1):
+        return _BreakNode(position, line, fitness_class, 0, 0, 0, 0)
+
+    n1, n2, n3, n4 = node(5, 2), node(3, 1), node(7, 2), node(7, 2)
+    active = _ActiveNodes([n1, n2, n3])
+    assert not active.add(n4)
+    assert list(active) == [n2, n3, n1]
+    assert len(active) == 3
+
+    active.deactivate(n3)
+    assert list(active) == [n2, n1]
+    active.compact()
+    active.deactivate(n2)
+    active.compact()
+    assert active.lines == [2]
+    assert list(active) == [n1]
+    assert active.add(n4)
+
+_patterns = '1ba 1na .ba4 4a.'
+
+def test_hyphenator_caches_its_packed_trie(tmp_path):
+    built = Hyphenator(_patterns, cache_dir=str(tmp_path))
+    assert built.trie.mapping is None
+    assert len(os.listdir(str(tmp_path))) == 1
+    loaded = Hyphenator(_patterns, cache_dir=str(tmp_path))
+    assert loaded.trie.mapping is not None
+    for h in built, loaded:
+        assert h.hyphenate_word('bananas') == ('bana', 'nas')
+        assert h.hyphenate_word('cabana') == ('ca', 'ba', 'na')
+
+def test_hyphenator_takes_patterns_with_any_letters(tmp_path):
+    patterns = _patterns.replace('a', 'é')
+    built = Hyphenator(patterns, cache_dir=str(tmp_path))
+    loaded = Hyphenator(patterns, cache_dir=str(tmp_path))
+    assert loaded.trie.mapping is not None
+    for h in built, loaded:
+        assert h.trie.alphabet == '.bné'
+        assert h.hyphenate_word('bénénés') == ('béné', 'nés')
+        assert h.hyphenate_word('cébéné') == ('cé', 'bé', 'né')
+
+def test_hyphenator_rebuilds_a_truncated_packed_trie(tmp_path):
+    Hyphenator(_patterns, cache_dir=str(tmp_path))
+    path, = tmp_path.iterdir()
+    path.write_bytes(path.read_bytes()[:-1])
+    h = Hyphenator(_patterns, cache_dir=str(tmp_path))
+    assert h.hyphenate_word('bananas') == ('bana', 'nas')
+
+def test_hyphenator_works_without_a_writable_cache(tmp_path):
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    h = Hyphenator(_patterns, cache_dir=str(blocker))
+    assert h.hyphenate_word('bananas') == ('bana', 'nas')
+
+def test_hyphenator_memo_shares_immutable_results(tmp_path):
+    h = Hyphenator(_patterns, cache_dir=str(tmp_path), memo_size=2)
+    pieces = h.hyphenate_word('bananas')
+    assert h.hyphenate_word('bananas') is pieces
+    h.hyphenate_word('cabana')
+    h.hyphenate_word('banana')
+    assert 'bananas' not in h.memo
+    assert h.memo.stats() == {'hits': 1, 'misses': 3, 'size': 2, 'maxsize': 2}
+
+def test_hyphenate_runs_as_a_script():
+    from typesetting.vendored import hyphenate
+    output = subprocess.check_output(
+        [sys.executable, hyphenate.__file__, 'hyphenation'],
+        universal_newlines=True)
+    assert output == 'hy-phen-ation\n'
+
+# Growth bounds for the scaling tests, as the largest exponent k allowed
+# in work = c * size ** k, fit over sizes of 1x, 4x, and 16x.  Work is
+# counted rather than timed, so that the tests cannot be flaky: active
+# nodes considered while breaking lines, calls to next_line, steps taken
+# back along the chain of lines, and action runs, which include each
+# time a galley is placed again.
+_scaling_sizes = 1, 4, 16
+_linear = 1.15
+
+def test_breaking_scales_linearly_with_paragraph_length():
+    def work(size):
+        olist = PackedObjectList()
+        for i in range(40 * size):
+            olist.append_box(5 * (3 + i % 7), 'word')
+            olist.append_glue(5, 2.5, 1.7)
+        olist.pop()
+        olist.add_closing_penalty()
+        stats = BreakStats()
+        olist.compute_breakpoints_escalating([200], stats=stats)
+        return stats.active_total + stats.deactivated
+    assert _growth_exponent(work) <= _linear
+
+def test_knuth_paragraph_scales_linearly_with_paragraph_length():
+    next_line = single_column_layout(200, 200, 0, 0, 0, 0)
+
+    def work(size):
+        paragraph_cache.clear()
+        # Starting at four copies, so that every size needs a second
+        # tolerance attempt.
+        text = ' '.join([_easy_text] * 4 * size)
+        actions = [(knuth_paragraph, 0, 0, [('mono', text)])]
+        next_line2, counts = _counting(next_line)
+        profiler = Profiler()
+        run(actions, _fonts, None, next_line2, profiler=profiler)
+        return profiler.breaking.active_total + sum(counts)
+    assert _growth_exponent(work) <= _linear
+
+def test_compose_scales_linearly_with_number_of_sections():
+    next_line = single_column_layout(200, 200, 0, 0, 0, 0)
+
+    def work(size):
+        paragraph_cache.clear()
+        actions = []
+        for i in range(size * 4):
+            actions.extend([
+                (section_break, 'body', 'graphic'),
+                (section_title,),
+                (knuth_paragraph, 0, 0, [('mono', 'Section %d' % i)]),
+                (avoid_widows_and_orphans,),
+                (knuth_paragraph, 0, 0, [('mono', '%d %s' % (i, _easy_text))]),
+                (avoid_widows_and_orphans,),
+                (knuth_paragraph, 0, 0, [('mono', _easy_text[i:])]),
+            ])
+        next_line2, counts = _counting(next_line)
+        profiler = Profiler()
+        run(actions, _fonts, None, next_line2, profiler=profiler)
+        action_calls = sum(s.calls for s in profiler.actions.values())
+        return action_calls + sum(counts) + profiler.breaking.active_total
+    assert _growth_exponent(work) <= _linear
+
+class _CountingLine(Line):
+    """A Line that counts each step taken back along the chain of lines."""
+    __slots__ = ()
+    counts = None
+
+    @property
+    def previous(self):
+        self.counts[1] += 1
+        return tuple.__getitem__(self, 0)
+
+    @property
+    def jump(self):
+        self.counts[1] += 1
+        return tuple.__getitem__(self, 5)
+
+def _counting(next_line):
+    """Wrap `next_line` to count its calls, and the steps taken back from
+    the lines it makes, as ``[calls, steps]``."""
+    counts = [0, 0]
+    line_class = type('_CountingLine', (_CountingLine,),
+                      {'__slots__': (), 'counts': counts})
+
+    def next_line2(line, leading, height):
+        counts[0] += 1
+        return line_class(*next_line(line, leading, height))
+    return next_line2, counts
+
+def _growth_exponent(work):
+    """Fit work = c * size ** k by least squares in log-log, returning k."""
+    xs = [math.log(size) for size in _scaling_sizes]
+    ys = [math.log(work(size)) for size in _scaling_sizes]
+    mx = sum(xs) / len(xs)
+    my = sum(ys) / len(ys)
+    return (sum((x - mx) * (y - my) for x, y in zip(xs, ys))
+            / sum((x - mx) ** 2 for x in xs))
+
+class _MonoFont(Font):
+    def width_of(self, text):
+        return 5 * len(text)
+
 _fonts = {
     'body': Font(8, 2, 10, 2),  # 10 point, with 2 points leading
     'tiny': Font(8, 2, 2, 2),   # 2 point, with 2 points leading
+    'mono': _MonoFont(8, 2, 10, 2),
 }
 
 def _run(*actions):
@@ -343,6 +1232,13 @@ def _run(*actions):
     lines = unroll(None, line)[1:]
     return [(line.column.id, line.y, line.graphics) for line in lines]
 
+def _knuth_run(width, *actions):
+    next_line = single_column_layout(width, 200, 0, 0, 0, 0)
+    line = run(actions, _fonts, None, next_line)
+    lines = unroll(None, line)[1:]
+    return [[text for x, font_name, text in xlist]
+            for line in lines for function, xlist in line.graphics]
+
 def _debug(line):
     lines = unroll(None, line)[1:]
     for i, line in enumerate(lines, 1):
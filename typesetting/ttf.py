@@ -0,0 +1,365 @@
+"""Font metrics read straight from TrueType and OpenType files.
+
+This lets layout run without Qt, or any other GUI stack: for example,
+in the worker processes of a process pool, with only the final drawing
+done by a writer like `QtWriter`.  Only what layout needs is read --
+the ascent, descent, and line gap from the ``hhea`` table, advance
+widths from ``hmtx``, the character map from ``cmap``, and pair
+kerning from the ``GPOS`` table's ``kern`` feature or, failing that,
+from an old-style ``kern`` table.  Ligatures and other shaping are not
+applied.
+
+    >>> metrics = TTFMetrics('fonts/GenBasR.ttf')
+    >>> fonts = {'roman': metrics.font(12)}
+
+"""
+import mmap
+import struct
+
+from .metrics import AdvanceTable, ScaledFont
+
+class TTFMetrics(object):
+    """The metrics of a font file, measured at unit size.
+
+    With `use_mmap`, the file is memory-mapped while it is parsed, so
+    that only the tables that are needed are read from disk.  Nothing
+    refers to the file afterwards, so the metrics can be pickled and
+    sent to other processes.
+
+    """
+    def __init__(self, path, use_mmap=False):
+        self.path = path
+        with open(path, 'rb') as f:
+            if use_mmap:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    self._parse(data)
+            else:
+                self._parse(f.read())
+        self.advances = AdvanceTable(self.measure, 1)
+
+    def _parse(self, data):
+        tables = _table_directory(data)
+
+        def table(tag):
+            offset, length = tables[tag]
+            return bytes(data[offset:offset + length])
+
+        head = table(b'head')
+        units_per_em, = struct.unpack_from('>H', head, 18)
+        scale = 1.0 / units_per_em
+
+        hhea = table(b'hhea')
+        ascender, descender, line_gap = struct.unpack_from('>hhh', hhea, 4)
+        number_of_hmetrics, = struct.unpack_from('>H', hhea, 34)
+        self.ascent = ascender * scale
+        self.descent = -descender * scale
+        self.height = self.ascent + self.descent
+        self.leading = line_gap * scale
+
+        num_glyphs, = struct.unpack_from('>H', table(b'maxp'), 4)
+        hmtx = table(b'hmtx')
+        widths = [struct.unpack_from('>H', hmtx, 4 * i)[0] * scale
+                  for i in range(number_of_hmetrics)]
+        widths.extend([widths[-1]] * (num_glyphs - number_of_hmetrics))
+        self.glyph_widths = widths
+
+        self.cmap = _parse_cmap(table(b'cmap'))
+
+        self.kerning = {}
+        self.kerning_lookups = []
+        if b'GPOS' in tables:
+            self.kerning_lookups = _parse_gpos_kerning(table(b'GPOS'))
+        if not self.kerning_lookups and b'kern' in tables:
+            self.kerning = _parse_kern(table(b'kern'))
+        self.kerning_scale = scale
+
+    def glyph(self, char):
+        """Return the glyph index for `char`, or 0 if it has none."""
+        return self.cmap.get(ord(char), 0)
+
+    def kern(self, left, right):
+        """Return the unit-size kerning between two glyph indexes."""
+        total = self.kerning.get((left, right), 0)
+        for lookup in self.kerning_lookups:
+            for subtable in lookup:
+                value = subtable.value(left, right)
+                if value is not None:
+                    total += value
+                    break
+        return total * self.kerning_scale
+
+    def measure(self, text):
+        """Return the unit-size width of `text`, with kerning."""
+        glyphs = [self.glyph(char) for char in text]
+        widths = self.glyph_widths
+        width = sum(widths[glyph] for glyph in glyphs)
+        for left, right in zip(glyphs, glyphs[1:]):
+            width += self.kern(left, right)
+        return width
+
+    def font(self, size, maxsize=4096):
+        """Return a `TTFFont` of this face at the given point `size`."""
+        return TTFFont(self, size, maxsize)
+
+class TTFFont(ScaledFont):
+    """A font for layout, with the same interface as a `QtFont`.
+
+    Its widths come from the shared unit-size `AdvanceTable` of its
+    `TTFMetrics`, so every size of a face shares one set of measurements.
+
+    """
+    def __init__(self, metrics, size, maxsize=4096):
+        super(TTFFont, self).__init__(metrics, metrics.advances, size, maxsize)
+        self.ascent = metrics.ascent * size
+        self.descent = metrics.descent * size
+        self.height = metrics.height * size
+        self.leading = metrics.leading * size
+
+def load_fonts(font_specs, use_mmap=False):
+    """Return a dict of fonts given ``(key, path, size)`` tuples.
+
+    This is the headless counterpart of `QtWriter.get_fonts()`.  Each
+    file is read only once, however many sizes of it are requested.
+
+    """
+    faces = {}
+    fonts = {}
+    for key, path, size in font_specs:
+        metrics = faces.get(path)
+        if metrics is None:
+            metrics = faces[path] = TTFMetrics(path, use_mmap)
+        fonts[key] = metrics.font(size)
+    return fonts
+
+def _table_directory(data):
+    if bytes(data[:4]) == b'ttcf':
+        # A font collection: use its first font.
+        offset, = struct.unpack_from('>I', data, 12)
+    else:
+        offset = 0
+    num_tables, = struct.unpack_from('>H', data, offset + 4)
+    tables = {}
+    for i in range(num_tables):
+        tag, checksum, table_offset, length = struct.unpack_from(
+            '>4sIII', data, offset + 12 + 16 * i)
+        tables[tag] = (table_offset, length)
+    return tables
+
+def _parse_cmap(data):
+    """Return a dict mapping code points to glyph indexes."""
+    num_tables, = struct.unpack_from('>H', data, 2)
+    subtables = {}
+    for i in range(num_tables):
+        platform, encoding, offset = struct.unpack_from('>HHI', data, 4 + 8 * i)
+        format, = struct.unpack_from('>H', data, offset)
+        subtables[platform, encoding, format] = offset
+
+    for key in (3, 10, 12), (0, 6, 12), (0, 4, 12):
+        if key in subtables:
+            return _parse_cmap_format_12(data, subtables[key])
+    for key in (3, 1, 4), (0, 3, 4), (0, 1, 4), (0, 0, 4), (3, 0, 4):
+        if key in subtables:
+            return _parse_cmap_format_4(data, subtables[key])
+    raise ValueError('font has no Unicode character map that can be read')
+
+def _parse_cmap_format_4(data, offset):
+    seg_count = struct.unpack_from('>H', data, offset + 6)[0] // 2
+    ends = struct.unpack_from('>%dH' % seg_count, data, offset + 14)
+    starts_offset = offset + 16 + 2 * seg_count
+    starts = struct.unpack_from('>%dH' % seg_count, data, starts_offset)
+    deltas = struct.unpack_from('>%dH' % seg_count, data,
+                                starts_offset + 2 * seg_count)
+    range_offsets_offset = starts_offset + 4 * seg_count
+    range_offsets = struct.unpack_from('>%dH' % seg_count, data,
+                                       range_offsets_offset)
+    cmap = {}
+    for i in range(seg_count):
+        start, end = starts[i], ends[i]
+        if start == 0xFFFF:
+            continue
+        delta, range_offset = deltas[i], range_offsets[i]
+        for code in range(start, end + 1):
+            if range_offset:
+                address = (range_offsets_offset + 2 * i + range_offset
+                           + 2 * (code - start))
+                glyph, = struct.unpack_from('>H', data, address)
+                if glyph:
+                    glyph = (glyph + delta) & 0xFFFF
+            else:
+                glyph = (code + delta) & 0xFFFF
+            if glyph:
+                cmap[code] = glyph
+    return cmap
+
+def _parse_cmap_format_12(data, offset):
+    num_groups, = struct.unpack_from('>I', data, offset + 12)
+    cmap = {}
+    for i in range(num_groups):
+        start, end, glyph = struct.unpack_from('>III', data,
+                                               offset + 16 + 12 * i)
+        for code in range(start, end + 1):
+            cmap[code] = glyph + code - start
+    return cmap
+
+def _parse_kern(data):
+    """Return a dict mapping glyph pairs to kerning, from a kern table."""
+    kerning = {}
+    version, = struct.unpack_from('>H', data, 0)
+    if version == 0:
+        num_tables, = struct.unpack_from('>H', data, 2)
+        offset = 4
+        for i in range(num_tables):
+            length, coverage = struct.unpack_from('>HH', data, offset + 2)
+            if coverage >> 8 == 0 and coverage & 1:  # format 0, horizontal
+                _parse_kern_pairs(data, offset + 6, kerning)
+            offset += length
+    else:  # Apple's version 1.0
+        num_tables, = struct.unpack_from('>I', data, 4)
+        offset = 8
+        for i in range(num_tables):
+            length, coverage = struct.unpack_from('>IH', data, offset)
+            if coverage & 0xFF == 0 and not coverage & 0xE000:
+                _parse_kern_pairs(data, offset + 8, kerning)
+            offset += length
+    return kerning
+
+def _parse_kern_pairs(data, offset, kerning):
+    num_pairs, = struct.unpack_from('>H', data, offset)
+    for i in range(num_pairs):
+        left, right, value = struct.unpack_from('>HHh', data,
+                                                offset + 8 + 6 * i)
+        kerning[left, right] = kerning.get((left, right), 0) + value
+
+def _parse_gpos_kerning(data):
+    """Return the pair-adjustment lookups used by the kern feature.
+
+    Each lookup is returned as a list of its subtables.
+
+    """
+    feature_list, lookup_list = struct.unpack_from('>HH', data, 6)
+
+    indexes = set()
+    feature_count, = struct.unpack_from('>H', data, feature_list)
+    for i in range(feature_count):
+        tag, offset = struct.unpack_from('>4sH', data, feature_list + 2 + 6 * i)
+        if tag == b'kern':
+            offset += feature_list
+            count, = struct.unpack_from('>H', data, offset + 2)
+            indexes.update(struct.unpack_from('>%dH' % count, data, offset + 4))
+
+    lookups = []
+    lookup_count, = struct.unpack_from('>H', data, lookup_list)
+    offsets = struct.unpack_from('>%dH' % lookup_count, data, lookup_list + 2)
+    for index in sorted(indexes):
+        offset = lookup_list + offsets[index]
+        lookup_type, flag, count = struct.unpack_from('>HHH', data, offset)
+        subtables = []
+        for subtable_offset in struct.unpack_from('>%dH' % count, data,
+                                                  offset + 6):
+            subtable_offset += offset
+            subtable_type = lookup_type
+            if lookup_type == 9:  # extension
+                subtable_type, extension = struct.unpack_from(
+                    '>HI', data, subtable_offset + 2)
+                subtable_offset += extension
+            if subtable_type == 2:
+                subtables.append(_parse_pair_adjustment(data, subtable_offset))
+        if subtables:
+            lookups.append(subtables)
+    return lookups
+
+def _parse_pair_adjustment(data, offset):
+    format, coverage_offset, format1, format2 = struct.unpack_from(
+        '>HHHH', data, offset)
+    coverage = _parse_coverage(data, offset + coverage_offset)
+    size1 = 2 * bin(format1).count('1')
+    size2 = 2 * bin(format2).count('1')
+
+    if format1 & 4:  # the first glyph's value record has an XAdvance
+        advance_at = 2 * bin(format1 & 3).count('1')
+
+        def x_advance(record_offset):
+            return struct.unpack_from('>h', data, record_offset + advance_at)[0]
+    else:
+        def x_advance(record_offset):
+            return 0
+
+    if format == 1:
+        pair_set_count, = struct.unpack_from('>H', data, offset + 8)
+        pair_set_offsets = struct.unpack_from('>%dH' % pair_set_count, data,
+                                              offset + 10)
+        pairs = {}
+        for glyph, index in coverage.items():
+            pair_set = offset + pair_set_offsets[index]
+            count, = struct.unpack_from('>H', data, pair_set)
+            record_size = 2 + size1 + size2
+            values = pairs[glyph] = {}
+            for i in range(count):
+                record = pair_set + 2 + record_size * i
+                second, = struct.unpack_from('>H', data, record)
+                values[second] = x_advance(record + 2)
+        return _GlyphPairs(pairs)
+
+    class_def1, class_def2, count1, count2 = struct.unpack_from(
+        '>HHHH', data, offset + 8)
+    record_size = size1 + size2
+    matrix = []
+    for i in range(count1):
+        row_offset = offset + 16 + record_size * count2 * i
+        matrix.append([x_advance(row_offset + record_size * j)
+                       for j in range(count2)])
+    return _ClassPairs(coverage,
+                       _parse_class_def(data, offset + class_def1),
+                       _parse_class_def(data, offset + class_def2),
+                       matrix)
+
+class _GlyphPairs(object):
+    """A pair adjustment subtable listing individual pairs of glyphs."""
+    def __init__(self, pairs):
+        self.pairs = pairs
+
+    def value(self, left, right):
+        values = self.pairs.get(left)
+        if values is not None:
+            return values.get(right)
+
+class _ClassPairs(object):
+    """A pair adjustment subtable keyed on classes of glyphs."""
+    def __init__(self, coverage, classes1, classes2, matrix):
+        self.coverage = coverage
+        self.classes1 = classes1
+        self.classes2 = classes2
+        self.matrix = matrix
+
+    def value(self, left, right):
+        if left in self.coverage:
+            row = self.matrix[self.classes1.get(left, 0)]
+            return row[self.classes2.get(right, 0)]
+
+def _parse_coverage(data, offset):
+    """Return a dict mapping each covered glyph to its coverage index."""
+    format, count = struct.unpack_from('>HH', data, offset)
+    if format == 1:
+        glyphs = struct.unpack_from('>%dH' % count, data, offset + 4)
+        return {glyph: index for index, glyph in enumerate(glyphs)}
+    coverage = {}
+    for i in range(count):
+        start, end, index = struct.unpack_from('>HHH', data, offset + 4 + 6 * i)
+        for glyph in range(start, end + 1):
+            coverage[glyph] = index + glyph - start
+    return coverage
+
+def _parse_class_def(data, offset):
+    """Return a dict mapping glyphs to their nonzero classes."""
+    format, = struct.unpack_from('>H', data, offset)
+    if format == 1:
+        start, count = struct.unpack_from('>HH', data, offset + 2)
+        classes = struct.unpack_from('>%dH' % count, data, offset + 6)
+        return {start + i: c for i, c in enumerate(classes) if c}
+    count, = struct.unpack_from('>H', data, offset + 2)
+    class_def = {}
+    for i in range(count):
+        start, end, c = struct.unpack_from('>HHH', data, offset + 4 + 6 * i)
+        for glyph in range(start, end + 1):
+            class_def[glyph] = c
+    return class_def
@@ -1,74 +1,289 @@
 """ Hyphenation, using Frank Liang's algorithm.
 
     This module provides a single function to hyphenate words.  hyphenate_word takes
-    a string (the word), and returns a list of parts that can be separated by hyphens.
+    a string (the word), and returns a tuple of parts that can be separated by hyphens.
 
     >>> hyphenate_word("hyphenation")
-    ['hy', 'phen', 'ation']
+    ('hy', 'phen', 'ation')
     >>> hyphenate_word("supercalifragilisticexpialidocious")
-    ['su', 'per', 'cal', 'ifrag', 'ilis', 'tic', 'ex', 'pi', 'ali', 'do', 'cious']
+    ('su', 'per', 'cal', 'ifrag', 'ilis', 'tic', 'ex', 'pi', 'ali', 'do', 'cious')
     >>> hyphenate_word("project")
-    ['project']
+    ('project',)
+
+    The patterns are compiled into a packed trie: a double array of
+    transitions plus a flat table of points.  The compiled trie is
+    written to a cache directory the first time it is built, and later
+    processes memory-map that file instead of parsing the patterns again.
+    Results are remembered per word in a bounded least-recently-used memo,
+    whose `hits` and `misses` are available as `hyphenator.memo.stats()`.
 
     Ned Batchelder, July 2007.
     This Python code is in the public domain.
 """
 
+import hashlib
+import mmap
+import os
 import re
+import sys
+import tempfile
+from array import array
+from collections import OrderedDict
 
 __version__ = '1.0.20070709'
 
-class Hyphenator:
-    def __init__(self, patterns, exceptions=''):
-        self.tree = {}
+_MAGIC = 0x4c69616e
+_FORMAT = 2
+
+def default_cache_dir():
+    """Return the directory where compiled tries are cached."""
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(root, 'python-typesetting')
+
+class PackedTrie:
+    """Liang patterns compiled into a double-array trie.
+
+    The characters of the patterns, in order, make up the `alphabet`,
+    and a character's code is one more than its index there.  State 0
+    is the root.  The transition from state `s` on a character with
+    code `c` leads to state `t = base[s] + c` if `check[t] == s`.
+    The points of a pattern ending in state `t` are the slice
+    `points[start[t]:end[t]]`.  The four tables and `points` are either
+    arrays or memoryviews of a mapped cache file.
+
+    """
+    def __init__(self, alphabet, base, check, start, end, points,
+                 mapping=None):
+        self.alphabet = alphabet
+        self.codes = {c: i + 1 for i, c in enumerate(alphabet)}
+        self.base = base
+        self.check = check
+        self.start = start
+        self.end = end
+        self.points = points
+        self.mapping = mapping
+
+    @classmethod
+    def compile(cls, patterns):
+        """Build a packed trie from a whitespace separated pattern string."""
+        tree = {}
         for pattern in patterns.split():
-            self._insert_pattern(pattern)
+            # Convert the a pattern like 'a1bc3d4' into a string of chars
+            # 'abcd' and a list of points [ 1, 0, 3, 4 ].
+            chars = re.sub('[0-9]', '', pattern)
+            points = [ int(d or 0) for d in re.split("[^0-9]", pattern) ]
+            t = tree
+            for c in chars:
+                t = t.setdefault(c, {})
+            t[None] = points
+        alphabet = ''.join(sorted(set(re.sub(r'[0-9\s]', '', patterns))))
+        codes = {c: i + 1 for i, c in enumerate(alphabet)}
+
+        base = array('i', [0])
+        check = array('i', [-1])
+        start = array('i', [0])
+        end = array('i', [0])
+        flat = array('i')
+        used = bytearray(1)
+        used[0] = 1
+
+        # Place states breadth first, giving each the lowest base at
+        # which all of its children land in free slots.
+        queue = [(0, tree)]
+        lowest_free = 1
+        for state, t in queue:
+            children = sorted(codes[c] for c in t if c is not None)
+            if None in t:
+                start[state] = len(flat)
+                flat.extend(t[None])
+                end[state] = len(flat)
+            if not children:
+                continue
+            while lowest_free < len(used) and used[lowest_free]:
+                lowest_free += 1
+            b = max(lowest_free - children[0], 0)
+            while any(b + c < len(used) and used[b + c] for c in children):
+                b += 1
+            grow = b + children[-1] + 1 - len(used)
+            if grow > 0:
+                used.extend(bytes(grow))
+                for table in base, start, end:
+                    table.extend([0] * grow)
+                check.extend([-1] * grow)
+            base[state] = b
+            for c in children:
+                used[b + c] = 1
+                check[b + c] = state
+                queue.append((b + c, t[alphabet[c - 1]]))
+        return cls(alphabet, base, check, start, end, flat)
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a trie written by `save()`; return None if unusable."""
+        try:
+            with open(path, 'rb') as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(mapping) % array('i').itemsize:
+            mapping.close()
+            return None
+        words = memoryview(mapping).cast('i')
+        if (len(words) < 5 or words[0] != _MAGIC or words[1] != _FORMAT
+            or len(words) != 5 + words[4] + 4 * words[2] + words[3]):
+            words.release()
+            mapping.close()
+            return None
+        size = words[2]
+        offset = 5 + words[4]
+        try:
+            alphabet = ''.join(map(chr, words[5:offset]))
+        except (ValueError, OverflowError):
+            words.release()
+            mapping.close()
+            return None
+        tables = [words[offset + i * size:offset + (i + 1) * size]
+                  for i in range(4)]
+        return cls(alphabet, *tables, points=words[offset + 4 * size:],
+                   mapping=mapping)
+
+    def save(self, path):
+        """Write the trie to `path`, atomically replacing any old file."""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        header = array('i', [_MAGIC, _FORMAT, len(self.base), len(self.points),
+                             len(self.alphabet)])
+        alphabet = array('i', map(ord, self.alphabet))
+        fd, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for table in (header, alphabet, self.base, self.check,
+                              self.start, self.end, self.points):
+                    f.write(table.tobytes())
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def points_of(self, work):
+        """Return the maximal Liang points for `work`, a lowercased word
+        surrounded by periods."""
+        base = self.base
+        check = self.check
+        start = self.start
+        end = self.end
+        flat = self.points
+        size = len(check)
+        codes = [self.codes.get(c, 0) for c in work]
+        points = [0] * (len(work)+1)
+        for i in range(len(work)):
+            s = 0
+            for code in codes[i:]:
+                t = base[s] + code
+                if not code or t >= size or check[t] != s:
+                    break
+                s = t
+                k = start[s]
+                for j in range(end[s] - k):
+                    if points[i+j] < flat[k+j]:
+                        points[i+j] = flat[k+j]
+        return points
+
+def _cache_path(cache_dir, patterns):
+    key = '{} {} {} {}'.format(_FORMAT, sys.byteorder, array('i').itemsize,
+                               ' '.join(patterns.split()))
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, 'hyphenate-{}.trie'.format(digest[:20]))
+
+class _Memo:
+    """The pieces of up to `maxsize` words, least recently used first.
+
+    This keeps the module self-contained, so that it can still be run
+    as a script; it follows `typesetting.cache.LRUCache`.
+
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, word):
+        return word in self._values
+
+    def get(self, word):
+        try:
+            pieces = self._values[word]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._values.move_to_end(word)
+        self.hits += 1
+        return pieces
+
+    def set(self, word, pieces):
+        if self.maxsize <= 0:
+            return
+        values = self._values
+        values[word] = pieces
+        values.move_to_end(word)
+        while len(values) > self.maxsize:
+            values.popitem(last=False)
+
+    def clear(self):
+        self._values.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._values), 'maxsize': self.maxsize}
+
+class Hyphenator:
+    def __init__(self, patterns, exceptions='', cache_dir=None, use_cache=True,
+                 memo_size=8192):
+        self.memo = _Memo(memo_size)
+        self.trie = None
+        if use_cache:
+            path = _cache_path(cache_dir or default_cache_dir(), patterns)
+            self.trie = PackedTrie.load(path)
+        if self.trie is None:
+            self.trie = PackedTrie.compile(patterns)
+            if use_cache:
+                try:
+                    self.trie.save(path)
+                except OSError:
+                    pass
 
         self.exceptions = {}
         for ex in exceptions.split():
             # Convert the hyphenated pattern into a point array for use later.
-            self.exceptions[ex.replace('-', '')] = [0] + [ int(h == '-') for h in re.split(r"[a-z]", ex) ]
-
-    def _insert_pattern(self, pattern):
-        # Convert the a pattern like 'a1bc3d4' into a string of chars 'abcd'
-        # and a list of points [ 1, 0, 3, 4 ].
-        chars = re.sub('[0-9]', '', pattern)
-        points = [ int(d or 0) for d in re.split("[.a-z]", pattern) ]
-
-        # Insert the pattern into the tree.  Each character finds a dict
-        # another level down in the tree, and leaf nodes have the list of
-        # points.
-        t = self.tree
-        for c in chars:
-            if c not in t:
-                t[c] = {}
-            t = t[c]
-        t[None] = points
+            self.exceptions[ex.replace('-', '')] = [0] + [ int(h == '-') for h in re.split(r"[^-]", ex) ]
 
     def hyphenate_word(self, word):
-        """ Given a word, returns a list of pieces, broken at the possible
+        """ Given a word, returns a tuple of pieces, broken at the possible
             hyphenation points.
         """
+        pieces = self.memo.get(word)
+        if pieces is None:
+            pieces = tuple(self._hyphenate_word(word))
+            self.memo.set(word, pieces)
+        return pieces
+
+    def _hyphenate_word(self, word):
         # Short words aren't hyphenated.
         if len(word) <= 4:
             return [word]
         # If the word is an exception, get the stored points.
-        if word.lower() in self.exceptions:
-            points = self.exceptions[word.lower()]
+        lower = word.lower()
+        if lower in self.exceptions:
+            points = self.exceptions[lower]
         else:
-            work = '.' + word.lower() + '.'
-            points = [0] * (len(work)+1)
-            for i in range(len(work)):
-                t = self.tree
-                for c in work[i:]:
-                    if c in t:
-                        t = t[c]
-                        if None in t:
-                            p = t[None]
-                            for j in range(len(p)):
-                                points[i+j] = max(points[i+j], p[j])
-                    else:
-                        break
+            points = self.trie.points_of('.' + lower + '.')
             # No hyphens in the first two chars or the last two.
             points[1] = points[2] = points[-2] = points[-3] = 0
 
@@ -514,7 +729,6 @@ del patterns
 del exceptions
 
 if __name__ == '__main__':
-    import sys
     if len(sys.argv) > 1:
         for word in sys.argv[1:]:
             print('-'.join(hyphenate_word(word)))
@@ -31,6 +31,12 @@ calling compute_adjustment_ratio(), and for each bit of glue, call its
 compute_width() method to figure out how long this dab of glue should
 be.
 
+The PackedObjectList class offers the same breaking algorithm over a
+paragraph that stores its widths, stretch, shrink, penalties, and flags
+in typed arrays instead of as a list of objects.  It is cheaper to
+build and to break, and ObjectList.compute_breakpoints() uses it
+internally.
+
 Reference:
     "Breaking Paragraphs into Lines", D.E. Knuth and M.F. Plass,
     chapter 3 of _Digital Typography_, CSLI Lecture Notes #78.
@@ -38,6 +44,9 @@ Reference:
 
 __version__ = "1.01"
 
+from array import array
+from bisect import insort
+
 INFINITY = 1000
 
 # Three classes defining the three different types of object that
@@ -114,10 +123,154 @@ class _BreakNode:
         self.totalwidth, self.totalstretch = totalwidth, totalstretch
         self.totalshrink, self.demerits = totalshrink, demerits
         self.previous = previous
+        self.active = True
+        # The demerits of every line up to this break.
+        self.total = demerits
+        if previous is not None:
+            self.total += previous.total
 
     def __repr__(self):
         return '<_BreakNode at %i>' % self.position
 
+class _ActiveNodes:
+    """The set of active breakpoints, bucketed by line number.
+
+    Iterating yields the nodes sorted by line number, and newest first
+    among nodes on the same line.  A dict keyed on (position, line,
+    fitness_class) keeps the nodes unique without a scan, and a node is
+    deactivated in O(1) by marking it; buckets that have lost nodes are
+    then swept in a single pass by compact().
+
+    """
+    def __init__(self, nodes=()):
+        self.lines = []       # line numbers that have a bucket, in order
+        self.buckets = {}     # line number -> list of nodes, oldest first
+        self.keys = {}        # (position, line, fitness_class) -> node
+        self.dirty = set()    # line numbers whose buckets need sweeping
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        for line in self.lines:
+            for node in reversed(self.buckets[line]):
+                if node.active:
+                    yield node
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def add(self, node):
+        """Add `node`, returning false if an equivalent node is active."""
+        key = (node.position, node.line, node.fitness_class)
+        if key in self.keys:
+            return False
+        self.keys[key] = node
+        node.active = True
+        bucket = self.buckets.get(node.line)
+        if bucket is None:
+            bucket = self.buckets[node.line] = []
+            insort(self.lines, node.line)
+        bucket.append(node)
+        return True
+
+    def add_nodes(self, nodes):
+        """Add each of `nodes` in turn.
+
+        Like the list-based code this replaces, the first node that
+        duplicates an active node stops the rest from being added.
+
+        """
+        for node in nodes:
+            if not self.add(node):
+                return
+
+    def deactivate(self, node):
+        node.active = False
+        del self.keys[node.position, node.line, node.fitness_class]
+        self.dirty.add(node.line)
+
+    def compact(self):
+        """Sweep deactivated nodes out of their buckets."""
+        for line in self.dirty:
+            bucket = [node for node in self.buckets[line] if node.active]
+            if bucket:
+                self.buckets[line] = bucket
+            else:
+                del self.buckets[line]
+                self.lines.remove(line)
+        self.dirty.clear()
+
+class BreakStats:
+    """Counts of the work done by compute_breakpoints().
+
+    Pass one as the `stats` argument of compute_breakpoints() or
+    compute_breakpoints_escalating() and each call adds to it: the
+    `calls` made, the `items` scanned, the `feasible` breakpoints
+    evaluated, the total and `active_peak` number of active nodes
+    considered at those breakpoints, the nodes `deactivated`, and the
+    tolerance `attempts` made.  The `failed` count is left to callers
+    that fall back to something else when no breaks are found.  Use
+    add() to total up the stats of several paragraphs.
+
+    When the active nodes are capped with `max_active`, the nodes
+    `pruned` are counted too, along with the `margin`: the least, over
+    the pruned nodes, of the total demerits by which a pruned node
+    trailed the best node kept for the same number of lines.  It is an
+    estimate of quality rather than a guarantee: pruning cost nothing
+    unless some pruned path could have made up at least that margin
+    over its remaining lines, so a large margin means the pruned paths
+    were far behind, and a small one that a near tie was cut.  It is
+    None while nothing has been pruned.  The `uncapped` count is of the
+    tolerances that failed with the cap but were then tried again
+    without it, since pruning may have been what made them fail.
+
+    """
+    __slots__ = ('calls', 'items', 'feasible', 'active_total',
+                 'active_peak', 'deactivated', 'attempts', 'failed',
+                 'pruned', 'margin', 'uncapped')
+
+    def __init__(self):
+        self.calls = self.items = self.feasible = 0
+        self.active_total = self.active_peak = self.deactivated = 0
+        self.attempts = self.failed = self.pruned = 0
+        self.margin = None
+        self.uncapped = 0
+
+    def __repr__(self):
+        return 'BreakStats({})'.format(', '.join(
+            '{}={}'.format(name, value)
+            for name, value in self.as_dict().items()))
+
+    @property
+    def active_average(self):
+        "The average number of active nodes at each feasible breakpoint."
+        return self.active_total / self.feasible if self.feasible else 0.0
+
+    def as_dict(self):
+        "Return a dict of every count."
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def add_pruned(self, margin, count=1):
+        "Count `count` pruned nodes, the closest of which trailed by `margin`."
+        self.pruned += count
+        if self.margin is None or margin < self.margin:
+            self.margin = margin
+
+    def add(self, other):
+        "Add the counts of another BreakStats to this one."
+        for name in self.__slots__:
+            if name == 'active_peak':
+                self.active_peak = max(self.active_peak, other.active_peak)
+            elif name == 'margin':
+                if other.margin is not None and (
+                        self.margin is None or other.margin < self.margin):
+                    self.margin = other.margin
+            else:
+                setattr(self, name, getattr(self, name) + getattr(other, name))
+
 class ObjectList(list):
 
     """Class representing a list of Box, Glue, and Penalty objects.
@@ -212,46 +365,14 @@ class ObjectList(list):
         return r
 
 
-    def add_active_nodes(self, active_nodes, nodes):
-        """Add nodes to the active node list.
-        The nodes are added so that the list of active nodes is always
-        sorted by line number, and so that the set of (position, line,
-        fitness_class) tuples has no repeated values.
-        """
-
-        for node in nodes:
-            index = 0
-
-            # Find the first index at which the active node's line number
-            # is equal to or greater than the line for 'node'.  This gives
-            # us the insertion point.
-            while (index < len(active_nodes) and
-                   active_nodes[index].line < node.line):
-                index = index + 1
-
-            insert_index = index
-
-            # Check if there's a node with the same line number and
-            # position and fitness.  This lets us ensure that the list of
-            # active nodes always has unique (line, position, fitness)
-            # values.
-            while (index < len(active_nodes) and
-                   active_nodes[index].line == node.line):
-                if (active_nodes[index].fitness_class == node.fitness_class and
-                    active_nodes[index].position == node.position):
-                    # A match, so just return without adding the node
-                    return
-
-                index = index + 1
-
-            active_nodes.insert(insert_index, node)
-
     def compute_breakpoints(self,
                             line_lengths,
                             looseness = 0,  # q in the paper
                             tolerance = 1,  # rho in the paper
                             fitness_demerit = 100, # gamma (XXX?) in the paper
                             flagged_demerit = 100, # alpha in the paper
+                            stats = None,
+                            max_active = None,
                             ):
         """Compute a list of optimal breakpoints for the paragraph
         represented by this ObjectList, returning them as a list of
@@ -273,116 +394,447 @@ class ObjectList(list):
         flagged_demerit : additional value added to the demerit score
                           when breaking at the second of two flagged
                           penalties.
+        stats : a BreakStats to which to add counts of the work done.
+        max_active : if given, the most active nodes to keep for each
+                     number of lines; the rest, those with the most
+                     total demerits, are pruned.  This bounds the work
+                     done on a long paragraph, at the risk of missing
+                     the optimal breaks.
         """
 
-        m = len(self)
-        if m == 0: return []            # No text, so no breaks
+        # The algorithm itself lives in PackedObjectList, which works
+        # on typed arrays instead of on the Box, Glue, and Penalty
+        # objects themselves.
+        packed = PackedObjectList(self)
+        packed.debug = self.debug
+        breaks = packed.compute_breakpoints(
+            line_lengths, looseness, tolerance,
+            fitness_demerit, flagged_demerit, stats, max_active)
+
+        # Keep the running sums, which compute_adjustment_ratio() needs.
+        self.sum_width = packed.sum_width
+        self.sum_stretch = packed.sum_stretch
+        self.sum_shrink = packed.sum_shrink
+        return breaks
 
-        # Precompute lists containing the numeric values for each box.
-        # The variable names follow those in Knuth's description.
-        w = [0]*m ;
-        y = [0]*m ; z = [0]*m
-        p = [0]*m ; f = [0]*m
-        for i in range(m):
-            box = self[i]
-            w[i] = box.width
-            if box.is_glue():
-                y[i] = box.stretch
-                z[i] = box.shrink
-            elif box.is_penalty():
-                p[i] = box.penalty
-                f[i] = box.flagged
-
-        # Precompute the running sums of width, stretch, and shrink
-        # (W,Y,Z in the original paper).  These make it easy to measure the
-        # width/stretch/shrink between two indexes; just compute
-        # sum_*[pos2] - sum_*[pos1].  Note that sum_*[i] is the total
-        # up to but not including the box at position i.
-
-        self.sum_width = [0] * m
-        self.sum_stretch = [0] * m
-        self.sum_shrink = [0] * m
+
+# Codes for the `kind` array of a PackedObjectList.
+BOX, GLUE, PENALTY = 0, 1, 2
+
+class PackedObjectList:
+
+    """A paragraph stored as parallel typed arrays.
+
+    Instead of a list of Box, Glue, and Penalty instances, the width,
+    stretch, shrink, penalty, and flag of each item live in one array
+    apiece, alongside a `kind` array saying whether each item is a BOX,
+    GLUE, or PENALTY.  This lets compute_breakpoints() run without ever
+    dispatching on per-item objects.  Only boxes carry `content`, which
+    is kept in an ordinary list.
+
+    """
+    debug = 0
+
+    def __init__(self, objects=()):
+        self.kind = array('b')
+        self.width = array('d')
+        self.stretch = array('d')
+        self.shrink = array('d')
+        self.penalty = array('d')
+        self.flagged = array('b')
+        self.content = []
+        self.extend(objects)
+
+    def __len__(self):
+        return len(self.kind)
+
+    def append_box(self, width, content=None):
+        self._append(BOX, width, 0, 0, 0, 0, content)
+
+    def append_glue(self, width, stretch, shrink):
+        self._append(GLUE, width, stretch, shrink, 0, 0, None)
+
+    def append_penalty(self, width, penalty, flagged=0):
+        self._append(PENALTY, width, 0, 0, penalty, flagged, None)
+
+    def _append(self, kind, width, stretch, shrink, penalty, flagged, content):
+        self.kind.append(kind)
+        self.width.append(width)
+        self.stretch.append(stretch)
+        self.shrink.append(shrink)
+        self.penalty.append(penalty)
+        self.flagged.append(flagged)
+        self.content.append(content)
+
+    def append(self, obj):
+        "Append a Box, Glue, or Penalty instance."
+        if obj.is_box():
+            self.append_box(obj.width, obj.content)
+        elif obj.is_glue():
+            self.append_glue(obj.width, obj.stretch, obj.shrink)
+        else:
+            self.append_penalty(obj.width, obj.penalty, obj.flagged)
+
+    def extend(self, objects):
+        "Append each of a sequence of Box, Glue, and Penalty instances."
+        for obj in objects:
+            self.append(obj)
+
+    def pop(self):
+        "Remove the final item."
+        for seq in (self.kind, self.width, self.stretch, self.shrink,
+                    self.penalty, self.flagged, self.content):
+            seq.pop()
+
+    def add_closing_penalty(self):
+        "Add the standard glue and penalty for the end of a paragraph"
+        self.append_penalty(0, INFINITY, 0)
+        self.append_glue(0, INFINITY, 0)
+        self.append_penalty(0, -INFINITY, 1)
+
+    def is_feasible_breakpoint(self, i):
+        "Return true if position 'i' is a feasible breakpoint."
+        kind = self.kind[i]
+        if kind == PENALTY:
+            return self.penalty[i] < INFINITY
+        return kind == GLUE and i > 0 and self.kind[i-1] == BOX
+
+    def is_forced_break(self, i):
+        "Return true if position 'i' is a forced breakpoint."
+        return self.kind[i] == PENALTY and self.penalty[i] == -INFINITY
+
+    def compute_glue_width(self, i, r):
+        """Return how long the glue at position 'i' should be, for the
+        given adjustment ratio r."""
+        if r < 0: return self.width[i] + r*self.shrink[i]
+        else:     return self.width[i] + r*self.stretch[i]
+
+    def compute_sums(self):
+        """Precompute the running sums of width, stretch, and shrink.
+
+        These are W, Y, and Z in the original paper, and make it easy to
+        measure the width/stretch/shrink between two indexes: just
+        compute sum_*[pos2] - sum_*[pos1].  Note that sum_*[i] is the
+        total up to but not including the item at position i.
+
+        """
+        m = len(self.kind)
+        sum_width = self.sum_width = array('d', bytes(8 * m))
+        sum_stretch = self.sum_stretch = array('d', bytes(8 * m))
+        sum_shrink = self.sum_shrink = array('d', bytes(8 * m))
+        kind, width = self.kind, self.width
+        stretch, shrink = self.stretch, self.shrink
         width_sum = stretch_sum = shrink_sum = 0
         for i in range(m):
-            self.sum_width[i] = width_sum
-            self.sum_stretch[i] = stretch_sum
-            self.sum_shrink[i] = shrink_sum
+            sum_width[i] = width_sum
+            sum_stretch[i] = stretch_sum
+            sum_shrink[i] = shrink_sum
+            if kind[i] != PENALTY:
+                width_sum = width_sum + width[i]
+                stretch_sum = stretch_sum + stretch[i]
+                shrink_sum = shrink_sum + shrink[i]
 
-            box = self[i]
-            if not box.is_penalty():
-                width_sum   = width_sum + box.width
-                stretch_sum = stretch_sum + box.stretch
-                shrink_sum  = shrink_sum + box.shrink
+    def measure_width(self, pos1, pos2):
+        "Add up the widths between positions 1 and 2"
+        return self.sum_width[pos2] - self.sum_width[pos1]
+
+    def measure_stretch(self, pos1, pos2):
+        "Add up the stretch between positions 1 and 2"
+        return self.sum_stretch[pos2] - self.sum_stretch[pos1]
+
+    def measure_shrink(self, pos1, pos2):
+        "Add up the shrink between positions 1 and 2"
+        return self.sum_shrink[pos2] - self.sum_shrink[pos1]
+
+    def compute_adjustment_ratio(self, pos1, pos2, line, line_lengths):
+        "Compute adjustment ratio for the line between pos1 and pos2"
+        length = self.sum_width[pos2] - self.sum_width[pos1]
+        if self.kind[pos2] == PENALTY: length += self.width[pos2]
+        if self.debug:
+            print('\tline length=', length)
+
+        # Get the length of the current line; if the line_lengths list
+        # is too short, the last value is always used for subsequent
+        # lines.
+
+        if line < len(line_lengths):
+            available_length = line_lengths[line]
+        else:
+            available_length = line_lengths[-1]
+
+        # Compute how much the contents of the line would have to be
+        # stretched or shrunk to fit into the available space.
+        if length < available_length:
+            y = self.sum_stretch[pos2] - self.sum_stretch[pos1]
+            if y > 0:
+                r = (available_length - length) / float(y)
+            else:
+                r = INFINITY
+
+        elif length > available_length:
+            z = self.sum_shrink[pos2] - self.sum_shrink[pos1]
+            if z > 0:
+                r = (available_length - length) / float(z)
+            else:
+                r = INFINITY
+        else:
+            # Exactly the right length!
+            r = 0
+
+        return r
+
+    def compute_breakpoints(self,
+                            line_lengths,
+                            looseness = 0,  # q in the paper
+                            tolerance = 1,  # rho in the paper
+                            fitness_demerit = 100, # gamma (XXX?) in the paper
+                            flagged_demerit = 100, # alpha in the paper
+                            stats = None,
+                            max_active = None,
+                            ):
+        """Compute a list of optimal breakpoints for this paragraph.
+
+        Takes the same arguments as ObjectList.compute_breakpoints().
+
+        """
+        breaks, tolerance = self.compute_breakpoints_escalating(
+            line_lengths, (tolerance,), looseness,
+            fitness_demerit, flagged_demerit, stats, max_active)
+        return breaks
+
+    def compute_breakpoints_escalating(self,
+                                       line_lengths,
+                                       tolerances = (1, 2, 3, 4, 5, 6, 7),
+                                       looseness = 0,
+                                       fitness_demerit = 100,
+                                       flagged_demerit = 100,
+                                       stats = None,
+                                       max_active = None,
+                                       ):
+        """Compute breakpoints at the first of `tolerances` that works.
+
+        Returns a tuple (breaks, tolerance) that also names the
+        tolerance that succeeded, and raises RuntimeError if even the
+        last tolerance fails.
+
+        Instead of starting over, each attempt after the first resumes
+        from the first position at which an earlier attempt rejected a
+        line that the new tolerance would accept, using the active nodes
+        saved at that position.  Up to there the two scans would make
+        exactly the same decisions, so the result is the same as a fresh
+        attempt.  A tolerance that would not have accepted any of the
+        rejected lines is skipped, as it would fail at the same place.
+
+        If a BreakStats is given as `stats`, counts of the work done are
+        added to it.  The active nodes for each number of lines can be
+        capped at `max_active`, as for compute_breakpoints().  Pruning
+        is never allowed to raise the tolerance: if a tolerance fails
+        after nodes were pruned, it is tried again without the cap,
+        which is then left off for the tolerances after it, so that a
+        paragraph costs at most one scan more than without the cap.
+
+        """
+        if stats is not None:
+            stats.calls += 1
+            stats.items += len(self.kind)
+        if len(self.kind) == 0:
+            return [], tolerances[0]  # No text, so no breaks
+
+        self.compute_sums()
+        tolerances = sorted(tolerances)
 
         # Initialize list of active nodes to a single break at the
         # beginning of the text.
         A = _BreakNode(position=0, line=0, fitness_class = 1,
                  totalwidth = 0, totalstretch = 0,
                  totalshrink = 0, demerits = 0)
-        active_nodes = [A]
+        start, nodes = 0, [A]
+
+        # Maps each higher tolerance to the position at which it would
+        # first make a different decision, and the active nodes there.
+        snapshots = {}
+
+        # The scan position of each node pruned by `max_active`, and
+        # the margin by which it trailed the best node that was kept.
+        pruned = []
+
+        for n, tolerance in enumerate(tolerances):
+            if n:
+                snapshot = snapshots.get(tolerance)
+                if snapshot is None:
+                    continue
+                start, nodes = snapshot
+                snapshots = {t: snapshot for t, snapshot in snapshots.items()
+                             if snapshot[0] < start}
+                pruned = [entry for entry in pruned if entry[0] < start]
+            capped = max_active is not None
+            if capped:
+                saved_snapshots = dict(snapshots)
+                pruned_before = len(pruned)
+            while True:
+                active_nodes = _ActiveNodes(reversed(nodes))
+                watch = [t for t in tolerances[n+1:] if t not in snapshots]
+                if stats is not None:
+                    stats.attempts += 1
+                if self._scan(active_nodes, start, line_lengths, tolerance,
+                              fitness_demerit, flagged_demerit,
+                              watch, snapshots, stats, max_active, pruned):
+                    if stats is not None and pruned:
+                        stats.add_pruned(min(margin for i, margin in pruned),
+                                         len(pruned))
+                    return _choose_breaks(active_nodes, looseness), tolerance
+                if not capped or len(pruned) == pruned_before:
+                    break
+                # The nodes pruned may have been the only way through,
+                # so scan this tolerance again from the same place
+                # without the cap, forgetting what the capped scan saw.
+                max_active = None
+                capped = False
+                snapshots = saved_snapshots
+                del pruned[pruned_before:]
+                if stats is not None:
+                    stats.uncapped += 1
+
+        if stats is not None and pruned:
+            stats.add_pruned(min(margin for i, margin in pruned), len(pruned))
+        raise RuntimeError('no solutions for this paragraph within a'
+                           ' bound of tolerance={}'.format(tolerance))
+
+    def compute_breakpoints_first_fit(self, line_lengths):
+        """Compute breakpoints greedily, filling one line at a time.
+
+        Each line is broken at the last feasible breakpoint that does
+        not make it shrink beyond its glue, however loose that leaves
+        it, and an overfull line is only set where even a single word
+        is too long.  This never fails, and is much faster than
+        compute_breakpoints(), but it does not weigh the lines against
+        each other and so sets looser, more uneven paragraphs.
+
+        """
+        kind = self.kind
+        p = self.penalty
+        m = len(kind)
+        if m == 0:
+            return []
+        self.compute_sums()
+        compute_adjustment_ratio = self.compute_adjustment_ratio
+
+        breaks = [0]
+        start = line = 0
+        last_fit = None
+        for i in range(m):
+            k = kind[i]
+            if k == PENALTY:
+                if p[i] >= INFINITY:
+                    continue
+                forced = (p[i] == -INFINITY)
+            elif k == GLUE and i > 0 and kind[i-1] == BOX:
+                forced = False
+            else:
+                continue
+
+            r = compute_adjustment_ratio(start, i, line, line_lengths)
+            if r < -1 and last_fit is not None:
+                # Too long: end the line at the last break that fit.
+                breaks.append(last_fit)
+                start, line, last_fit = last_fit, line + 1, None
+                r = compute_adjustment_ratio(start, i, line, line_lengths)
+            if forced or r < -1:
+                breaks.append(i)
+                start, line, last_fit = i, line + 1, None
+            else:
+                last_fit = i
+        return breaks
+
+    def _scan(self, active_nodes, start, line_lengths, tolerance,
+              fitness_demerit, flagged_demerit, watch, snapshots,
+              stats=None, max_active=None, pruned=None):
+        """Run the main loop from position `start` onward.
+
+        Returns true if the end of the paragraph is reached, or false if
+        the active nodes run out first.  For each of the `watch`
+        tolerances, records in `snapshots` the first position at which
+        a line is rejected that the tolerance would have accepted.
+        Counts of the work done are added to `stats`, unless it is None.
+        If `max_active` is given, the nodes beyond it for any number of
+        lines are deactivated, those with the most total demerits
+        first, and added to `pruned`.
+
+        """
+        # The variable names follow those in Knuth's description.
+        kind = self.kind
+        p = self.penalty
+        f = self.flagged
+        m = len(kind)
+
+        sum_width = self.sum_width
+        sum_stretch = self.sum_stretch
+        sum_shrink = self.sum_shrink
+        compute_adjustment_ratio = self.compute_adjustment_ratio
+
+        lines = active_nodes.lines
+        buckets = active_nodes.buckets
+        deactivate = active_nodes.deactivate
+        watch_limit = max(watch, default=tolerance)
 
         if self.debug:
             print('Looping over %i box objects' % m)
 
-        for i in range(m):
-            B = self[i]
-            #print(B, getattr(B, 'content', None))
-            # Determine if this box is a feasible breakpoint and
+        for i in range(start, m):
+            # Determine if this item is a feasible breakpoint and
             # perform the main loop if it is.
-            if not self.is_feasible_breakpoint(i):
+            k = kind[i]
+            if k == PENALTY:
+                if p[i] >= INFINITY:
+                    continue
+                forced = (p[i] == -INFINITY)
+            elif k == GLUE and i > 0 and kind[i-1] == BOX:
+                forced = False
+            else:
                 continue
+
             if self.debug:
                 print('Feasible breakpoint at %i:' % i)
                 print('\tCurrent active node list:', active_nodes)
 
-            if self.debug:
-                # Print the list of active nodes, sorting them
-                # so they can be visually checked for uniqueness.
-                def key_f(n):
-                    return (n.line, n.position, n.fitness_class)
-                active_nodes.sort(key=key_f)
-                for A in active_nodes:
-                    print(A.position, A.line, A.fitness_class)
-                print ; print
+            if stats is not None:
+                active_count = len(active_nodes)
+                stats.feasible += 1
+                stats.active_total += active_count
+                if active_count > stats.active_peak:
+                    stats.active_peak = active_count
 
             # Loop over the list of active nodes, and compute the fitness
             # of the line formed by breaking at A and B.  The resulting
             breaks = []                 # List of feasible breaks
-            for A in active_nodes[:]:
-                r = self.compute_adjustment_ratio(A.position, i, A.line, line_lengths)
+            for A in _newest_first(lines, buckets):
+                r = compute_adjustment_ratio(A.position, i, A.line,
+                                             line_lengths)
                 if self.debug:
                     print('\tr=', r)
                     print('\tline=', A.line)
 
-                # #print(r)
-                # if r<-1 or B.is_forced_break():
-                #     #continue
-                #     # Deactivate node A
-                #     if len(active_nodes) == 1:
-                #         if self.debug:
-                #             print "Can't remove last node!"
-                #             # XXX how should this be handled?
-                #             # Raise an exception?
-                #     else:
-                #         if self.debug:
-                #             print '\tRemoving node', A
-                #         active_nodes.remove(A)
-
-                # TODO: eliminate one of these?
-                assert B.is_forced_break() == self.is_forced_break(i)
-
-                if r < -1 or B.is_forced_break():
-                    active_nodes.remove(A)
+                if r < -1 or forced:
+                    deactivate(A)
 
                 tolerable = (-1 <= r <= tolerance)
-                # print r, tolerable
                 if not tolerable:
+                    if tolerance < r <= watch_limit:
+                        # A higher tolerance would diverge from this
+                        # scan here, so save the active nodes as they
+                        # stood at the start of this position.
+                        nodes = list(_newest_first(lines, buckets))
+                        for t in watch:
+                            if t >= r:
+                                snapshots[t] = (i, nodes)
+                        watch = [t for t in watch if t < r]
+                        watch_limit = max(watch, default=tolerance)
                     continue
 
                 # Compute demerits and fitness class
                 if p[i] >= 0:
                     demerits = (1 + 100 * abs(r)**3 + p[i]) ** 3
-                elif self.is_forced_break(i):
+                elif forced:
                     demerits = (1 + 100 * abs(r)**3) ** 2 - p[i]**2
                 else:
                     demerits = (1 + 100 * abs(r)**3) ** 2
@@ -408,41 +860,27 @@ class ObjectList(list):
                 # Record a feasible break from A to B
                 brk = _BreakNode(position = i, line = A.line + 1,
                               fitness_class = fitness_class,
-                              totalwidth = self.sum_width[i],
-                              totalstretch = self.sum_stretch[i],
-                              totalshrink = self.sum_shrink[i],
+                              totalwidth = sum_width[i],
+                              totalstretch = sum_stretch[i],
+                              totalshrink = sum_shrink[i],
                               demerits = demerits,
                               previous = A)
                 breaks.append(brk)
-                # print '=========='
-                if self.debug:
-                    print('\tRecording feasible break', B)
-                    print('\t\tDemerits=', demerits)
-                    print('\t\tFitness class=', fitness_class)
-
-                #print(r)
-
-                    # #continue
-                    # # Deactivate node A
-                    # if len(active_nodes) == 1:
-                    #     if self.debug:
-                    #         print "Can't remove last node!"
-                    #         # XXX how should this be handled?
-                    #         # Raise an exception?
-                    # else:
-                    #     if self.debug:
-                    #         print '\tRemoving node', A
-                    #     active_nodes.remove(A)
 
             # end for A in active_nodes
+            if stats is not None:
+                stats.deactivated += active_count - len(active_nodes)
+            if active_nodes.dirty:
+                active_nodes.compact()
             if breaks:
                 if self.debug:
                     print('List of breaks at ', i, ':', breaks)
-                self.add_active_nodes(active_nodes, breaks)
+                active_nodes.add_nodes(breaks)
+                if max_active is not None:
+                    _prune(active_nodes, breaks, max_active, i, pruned)
 
             if not active_nodes:
-                raise RuntimeError('no solutions for this paragraph within a'
-                                   ' bound of tolerance={}'.format(tolerance))
+                return False
 
         # end for i in range(m)
 
@@ -450,46 +888,72 @@ class ObjectList(list):
             print('Main loop completed')
             print('Active nodes=', active_nodes)
 
-        # Find the active node with the lowest number of demerits.
-        least_demerits = min(A.demerits for A in active_nodes)
-        for A in active_nodes:
-            if A.demerits == least_demerits:
-                break
-        # L = map(lambda A: (A.demerits, A), active_nodes)
-        # L.sort()
-        # _, A = L[0]
-
-        if looseness != 0:
-            # The search for the appropriate active node is a bit more
-            # complicated; we look for a node with a paragraph length
-            # that's as close as possible to (A.line+looseness), and
-            # with the minimum number of demerits.
-
-            best = 0
-            d = INFINITY
-            for br in active_nodes:
-                delta = br.line - A.line
-                # The two branches of this 'if' statement
-                # are for handling values of looseness that are
-                # either positive or negative.
-                if ((looseness<= delta < best) or
-                    (best<delta<looseness) ):
-                    d = br.demerits
-                    b = br
-
-                elif delta == best and br.demerits < d:
-                    # This break is of the same length, but has fewer
-                    # demerits and hence is a more attractive one.
-                    d = br.demerits
-                    b = br
-
-            A = b
-
-        # Use the chosen node A to determine the optimum breakpoints,
-        # and return the resulting list of breakpoints.
-        breaks = []
-        while A is not None:
-            breaks.append( A.position )
-            A = A.previous
-        breaks.reverse()
-        return breaks
+        return True
+
+def _prune(active_nodes, breaks, max_active, i, pruned):
+    """Keep the `max_active` best nodes on the lines of `breaks`."""
+    for line in {brk.line for brk in breaks}:
+        bucket = active_nodes.buckets.get(line)
+        if bucket is None or len(bucket) <= max_active:
+            continue
+        ranked = sorted(bucket, key=lambda node: node.total)
+        best = ranked[0].total
+        for node in ranked[max_active:]:
+            active_nodes.deactivate(node)
+            pruned.append((i, node.total - best))
+    if active_nodes.dirty:
+        active_nodes.compact()
+
+def _newest_first(lines, buckets):
+    """Yield each active node without copying the buckets first.
+
+    Nodes deactivated during the scan stay in their buckets until the
+    caller runs compact(), so the buckets can be walked in place.
+
+    """
+    for line in lines:
+        yield from reversed(buckets[line])
+
+def _choose_breaks(active_nodes, looseness):
+    """Return the breakpoints that lead to the best active node."""
+
+    # Find the active node with the lowest number of demerits.
+    least_demerits = min(A.demerits for A in active_nodes)
+    for A in active_nodes:
+        if A.demerits == least_demerits:
+            break
+
+    if looseness != 0:
+        # The search for the appropriate active node is a bit more
+        # complicated; we look for a node with a paragraph length
+        # that's as close as possible to (A.line+looseness), and
+        # with the minimum number of demerits.
+
+        best = 0
+        d = INFINITY
+        for br in active_nodes:
+            delta = br.line - A.line
+            # The two branches of this 'if' statement
+            # are for handling values of looseness that are
+            # either positive or negative.
+            if ((looseness<= delta < best) or
+                (best<delta<looseness) ):
+                d = br.demerits
+                b = br
+
+            elif delta == best and br.demerits < d:
+                # This break is of the same length, but has fewer
+                # demerits and hence is a more attractive one.
+                d = br.demerits
+                b = br
+
+        A = b
+
+    # Use the chosen node A to determine the optimum breakpoints,
+    # and return the resulting list of breakpoints.
+    breaks = []
+    while A is not None:
+        breaks.append( A.position )
+        A = A.previous
+    breaks.reverse()
+    return breaks
@@ -0,0 +1,120 @@
+"""Hyphenate and measure a document's words once, before composing it.
+
+A book repeats the same few thousand words over and over, but breaking
+each paragraph hyphenates and measures every word it contains.  A
+`Vocabulary` is built by scanning every `knuth_paragraph()` action in
+an action list for its distinct words, so that each is hyphenated and
+measured only once per font::
+
+    actions = with_vocabulary(actions, fonts)
+    compose(actions, fonts, None, next_line)
+
+The work of building a large vocabulary can be spread across a pool of
+processes, provided that the fonts can be pickled.
+
+"""
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from .knuth import _text_findall, knuth_paragraph, measure_token
+
+class Vocabulary(object):
+    """The tokens of a document, each measured and hyphenated in advance.
+
+    For each font name, `plain` and `hyphenated` map every ``(word,
+    punctuation)`` token to the boxes returned by `measure_token()`
+    without and with hyphenation.  The vocabulary only answers for the
+    same font objects that it was measured with.
+
+    """
+    def __init__(self, fonts):
+        self.fonts = dict(fonts)
+        self.plain = {}
+        self.hyphenated = {}
+
+    def __len__(self):
+        return sum(len(words) for words in self.plain.values())
+
+    def words_for(self, font_name, font, hyphenate):
+        """Return the token dict for a font, or None if it was not measured.
+
+        The hyphenated tokens are returned if `hyphenate` is not None.
+
+        """
+        if self.fonts.get(font_name) is not font:
+            return None
+        table = self.plain if hyphenate is None else self.hyphenated
+        return table.get(font_name)
+
+    def add(self, font_name, tokens, measurements):
+        """Record ``(plain, hyphenated)`` `measurements` for `tokens`."""
+        plain = self.plain.setdefault(font_name, {})
+        hyphenated = self.hyphenated.setdefault(font_name, {})
+        for token, (plain_boxes, hyphenated_boxes) in zip(tokens,
+                                                          measurements):
+            plain[token] = plain_boxes
+            hyphenated[token] = hyphenated_boxes
+
+def build_vocabulary(actions, fonts, processes=None, chunk_size=2000):
+    """Collect and measure the tokens of every paragraph in `actions`.
+
+    If `processes` is given, the tokens are measured by a pool of that
+    many worker processes, `chunk_size` tokens at a time.
+
+    """
+    vocabulary = Vocabulary(fonts)
+    tokens_by_font = {}
+    for fonts_and_texts in paragraph_texts(actions):
+        for font_name, text in fonts_and_texts:
+            tokens = tokens_by_font.setdefault(font_name, set())
+            for control_code, word, punctuation, space in _text_findall(text):
+                if word or punctuation:
+                    tokens.add((word, punctuation))
+
+    if not processes:
+        for font_name, tokens in tokens_by_font.items():
+            tokens = sorted(tokens)
+            measurements = _measure_tokens(fonts[font_name], tokens)
+            vocabulary.add(font_name, tokens, measurements)
+        return vocabulary
+
+    with ProcessPoolExecutor(processes) as executor:
+        jobs = []
+        for font_name, tokens in tokens_by_font.items():
+            tokens = sorted(tokens)
+            for i in range(0, len(tokens), chunk_size):
+                chunk = tokens[i:i + chunk_size]
+                future = executor.submit(_measure_tokens, fonts[font_name],
+                                         chunk)
+                jobs.append((font_name, chunk, future))
+        for font_name, chunk, future in jobs:
+            vocabulary.add(font_name, chunk, future.result())
+    return vocabulary
+
+def with_vocabulary(actions, fonts, processes=None):
+    """Return `actions` with its paragraphs sharing a new vocabulary."""
+    vocabulary = build_vocabulary(actions, fonts, processes)
+    new_actions = []
+    for action in actions:
+        if _is_paragraph(action[0]):
+            action = (partial(action[0], vocabulary=vocabulary),) + tuple(
+                action[1:])
+        new_actions.append(action)
+    return new_actions
+
+def paragraph_texts(actions):
+    """Generate the `fonts_and_texts` of each `knuth_paragraph()` action."""
+    for action in actions:
+        if _is_paragraph(action[0]):
+            yield action[3]
+
+def _is_paragraph(function):
+    while isinstance(function, partial):
+        function = function.func
+    return function is knuth_paragraph
+
+def _measure_tokens(font, tokens):
+    width_of = font.width_of
+    return [(measure_token(word, punctuation, width_of, None),
+             measure_token(word, punctuation, width_of))
+            for word, punctuation in tokens]
@@ -4,9 +4,14 @@ from PySide2 import QtWidgets
 from PySide2.QtCore import QSizeF, QMarginsF
 from PySide2.QtGui import QPainter, QPdfWriter, QFontDatabase
 
+from .metrics import AdvanceTable, CachedFont, ScaledFont
+
 MM = 25.4 / 72
 PT = 1200 / 72
 
+# Point size at which advance tables are measured.
+ADVANCE_TABLE_SIZE = 100
+
 class QtWriter(object):
 
     def __init__(self, path, width_pt, height_pt):
@@ -29,8 +34,17 @@ class QtWriter(object):
     def load_font(self, path):
         QFontDatabase.addApplicationFont(path)
 
-    def get_fonts(self, font_specs):
+    def get_fonts(self, font_specs, advance_tables=False):
+        """Return a dict of fonts, whose widths are cached.
+
+        With `advance_tables`, each face is measured character by
+        character at a single size, and every size of that face then
+        computes its widths from those measurements rather than asking
+        Qt; this is much faster, but ignores ligatures.
+
+        """
         fonts = {}
+        tables = {}
         database = QFontDatabase()
         for key, family, style, size in font_specs:
             weight = database.weight(family, style)
@@ -39,11 +53,25 @@ class QtWriter(object):
             if weight == -1 or family != actual_family:
                 print('Cannot find font: {!r} {!r}'.format(family, style))
                 os._exit(1)
+            if advance_tables and (family, style) not in tables:
+                tables[family, style] = self._advance_table(
+                    database, family, style)
             self.painter.setFont(qt_font)
             metrics = self.painter.fontMetrics()
-            fonts[key] = QtFont(qt_font, metrics)
+            font = QtFont(qt_font, metrics)
+            if advance_tables:
+                fonts[key] = ScaledFont(font, tables[family, style], size)
+            else:
+                fonts[key] = CachedFont(font)
         return fonts
 
+    def _advance_table(self, database, family, style):
+        qt_font = database.font(family, style, ADVANCE_TABLE_SIZE)
+        self.painter.setFont(qt_font)
+        metrics = self.painter.fontMetrics()
+        return AdvanceTable(QtFont(qt_font, metrics).width_of,
+                            ADVANCE_TABLE_SIZE)
+
     def new_page(self):
         self.writer.newPage()
         # if self.include_crop_marks: